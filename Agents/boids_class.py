@@ -11,10 +11,26 @@ License: MIT License
 -----
 Description: 
 """
+import csv
 from dataclasses import dataclass, field
+from itertools import product
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+import matplotlib.pyplot as plt
+from matplotlib.colors import hsv_to_rgb
 import numpy as np
 from os import system
-from time import sleep
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+import threading
+from time import perf_counter, sleep
+import weakref
+
+# Seconds a DomainPool barrier waits for the other processes before giving up
+BARRIER_TIMEOUT = 60
+# Seconds between worker liveness checks while a DomainPool step runs
+WORKER_POLL_INTERVAL = 1
 
 # TODO ADD DIFFERENT SHAPES DEPENDING ON THE DIRECTION OF THE AGENT
 
@@ -36,39 +52,601 @@ class Boid:
     radius: int = 3
 
 
+@dataclass
+class BoidViews:
+    """
+    Sequence of Boid views of the rows of position and velocity arrays.
+
+    Views are created on access, so nothing is allocated per boid up front.
+    Updating a view in place updates the arrays.
+
+    Attributes:
+        positions (np.ndarray): (N, 2) positions.
+        velocities (np.ndarray): (N, 2) velocities.
+    """
+
+    positions: np.ndarray
+    velocities: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getitem__(self, idx: int) -> Boid:
+        return Boid(position=self.positions[idx], velocity=self.velocities[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+def wrapped_delta(origin: np.ndarray, targets: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+    """Shortest displacement from origin to targets in a toroidal world.
+
+    Args:
+        origin (np.ndarray): (..., 2) starting positions.
+        targets (np.ndarray): (..., 2) end positions.
+        shape (tuple[int, int]): world size, distances wrap around it.
+
+    Returns:
+        np.ndarray: (..., 2) displacement vectors targets - origin.
+    """
+    size = np.asarray(shape, dtype=np.float64)
+    delta = np.asarray(targets, dtype=np.float64) - origin
+    return delta - size * np.round(delta / size)
+
+
+@dataclass
+class SpatialHash:
+    """
+    Uniform grid for neighbor queries in a toroidal world.
+
+    Positions are sorted by cell so the boids of a cell are a contiguous slice
+    of `order`. Rebuild it every step with the current positions. The grid
+    can cover only the region origin + [0, extent) of the world (e.g. a strip
+    and its halo), distances still wrap around the whole world.
+
+    Attributes:
+        shape (tuple[int, int]): World size.
+        cell_size (float): Side of a cell, usually the largest query radius.
+        origin (tuple[float, float]): Corner of the covered region. Defaults to (0, 0).
+        extent (tuple[float, float]): Size of the covered region, the whole
+            world if None. Defaults to None.
+    """
+
+    shape: tuple[int, int]
+    cell_size: float
+    origin: tuple[float, float] = (0, 0)
+    extent: tuple[float, float] = None
+    n_cells: tuple[int, int] = field(init=False)
+    positions: np.ndarray = field(init=False)
+    order: np.ndarray = field(init=False)
+    cell_start: np.ndarray = field(init=False)
+
+    def __post_init__(self):
+        if self.extent is None:
+            self.extent = self.shape
+        self.n_cells = tuple(max(1, int(side // self.cell_size)) for side in self.extent)
+        self.build(np.empty(shape=(0, 2)))
+
+    def cell_of(self, positions: np.ndarray) -> np.ndarray:
+        # Cells are slightly larger than cell_size so that n_cells covers the region
+        local = (positions - np.asarray(self.origin)) % np.asarray(self.shape)
+        cells = np.floor(local / np.asarray(self.extent) * self.n_cells).astype(np.int64)
+        return cells % self.n_cells
+
+    def __key(self, cells: np.ndarray) -> np.ndarray:
+        return cells[..., 0] * self.n_cells[1] + cells[..., 1]
+
+    def build(self, positions: np.ndarray):
+        self.positions = np.asarray(positions)
+        keys = self.__key(self.cell_of(self.positions))
+        self.order = np.argsort(keys, kind="stable")
+        self.cell_start = np.searchsorted(
+            keys[self.order], np.arange(self.n_cells[0] * self.n_cells[1] + 1)
+        )
+
+    def __offsets(self, radius: float) -> set[tuple[int, int]]:
+        # Offsets that land on the same cell after wrapping are visited once
+        reach = [int(np.ceil(radius / (side / n))) for side, n in zip(self.extent, self.n_cells)]
+        return {
+            (dx % self.n_cells[0], dy % self.n_cells[1])
+            for dx in range(-reach[0], reach[0] + 1)
+            for dy in range(-reach[1], reach[1] + 1)
+        }
+
+    def query(self, position: np.ndarray, radius: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Finds the points within radius of a position.
+
+        Args:
+            position (np.ndarray): (2,) query position.
+            radius (float): Search radius.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: Indices of the points,
+            wrapped displacements from position to them and their distances.
+        """
+        cell = self.cell_of(np.asarray(position))
+        candidates = []
+        for offset in self.__offsets(radius):
+            key = self.__key((cell + offset) % self.n_cells)
+            candidates.append(self.order[self.cell_start[key]:self.cell_start[key + 1]])
+        candidates = np.concatenate(candidates)
+
+        delta = wrapped_delta(position, self.positions[candidates], self.shape)
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        inside = distance < radius
+
+        return candidates[inside], delta[inside], distance[inside]
+
+    def pairs(self, radius: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Finds every pair of distinct points closer than radius.
+
+        Args:
+            radius (float): Search radius.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: Indices i and
+            j of each pair, wrapped displacements from i to j and distances.
+        """
+        n_points = len(self.positions)
+        cells = self.cell_of(self.positions)
+        i_list, j_list = [], []
+        for offset in self.__offsets(radius):
+            keys = self.__key((cells + offset) % self.n_cells)
+            start = self.cell_start[keys]
+            count = self.cell_start[keys + 1] - start
+            # Expands every point into the points of its neighboring cell
+            i = np.repeat(np.arange(n_points), count)
+            first = np.repeat(np.cumsum(count) - count, count)
+            j = self.order[np.repeat(start, count) + np.arange(count.sum()) - first]
+            i_list.append(i)
+            j_list.append(j)
+        i = np.concatenate(i_list)
+        j = np.concatenate(j_list)
+
+        delta = wrapped_delta(self.positions[i], self.positions[j], self.shape)
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        inside = (distance < radius) & (i != j)
+
+        return i[inside], j[inside], delta[inside], distance[inside]
+
+
+def flock_step(
+    positions: np.ndarray,
+    velocities: np.ndarray,
+    shape: tuple[int, int],
+    radius: float = Boid.radius,
+    separation_radius: float = 2,
+    coherence_factor: float = 8,
+    alignment_factor: float = 100,
+    origin: tuple[float, float] = (0, 0),
+    extent: tuple[float, float] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Applies the three boid rules to every boid with batched array operations.
+
+    Every boid reads the same positions and velocities, i.e. the update is
+    synchronous.
+
+    Args:
+        positions (np.ndarray): (N, 2) positions.
+        velocities (np.ndarray): (N, 2) velocities.
+        shape (tuple[int, int]): World size.
+        radius (float, optional): Visual range. Defaults to Boid.radius.
+        separation_radius (float, optional): Separation range. Defaults to 2.
+        coherence_factor (float, optional): Velocity matching factor. Defaults to 8.
+        alignment_factor (float, optional): Flock centering factor. Defaults to 100.
+        origin (tuple[float, float], optional): Corner of the region that holds
+            the boids. Defaults to (0, 0).
+        extent (tuple[float, float], optional): Size of that region, the whole
+            world if None. Defaults to None.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: New (N, 2) positions and velocities.
+    """
+    n_agents = len(positions)
+    spatial_hash = SpatialHash(
+        shape=shape, cell_size=max(radius, separation_radius), origin=origin, extent=extent
+    )
+    spatial_hash.build(positions)
+    # Pairs within both ranges, separation can reach further than the visual range
+    i, j, delta, distance = spatial_hash.pairs(max(radius, separation_radius))
+    # Sums run over the neighbors in index order, independent of the grid layout
+    order = np.lexsort((j, i))
+    i, j, delta, distance = i[order], j[order], delta[order], distance[order]
+
+    def neighbor_sum(values: np.ndarray) -> np.ndarray:
+        return np.stack(
+            [np.bincount(i, weights=values[:, axis], minlength=n_agents) for axis in range(2)],
+            axis=1,
+        )
+
+    # Flock centering and velocity matching only see the visual range
+    visible = distance < radius
+    n_neighbors = np.bincount(i[visible], minlength=n_agents)[:, None]
+    has_neighbors = n_neighbors > 0
+    mean_divisor = np.maximum(n_neighbors, 1)
+
+    # Separation, moves away from the neighbors that are too close
+    too_close = distance < separation_radius
+    v1 = -neighbor_sum(np.where(too_close[:, None], delta, 0))
+    # Flock centering, towards the center of the neighbors
+    v2 = neighbor_sum(np.where(visible[:, None], delta, 0)) / mean_divisor / alignment_factor
+    # Velocity matching with the neighbors
+    v3 = np.where(
+        has_neighbors, neighbor_sum(np.where(visible[:, None], velocities[j], 0)) / mean_divisor - velocities, 0
+    ) / coherence_factor
+
+    new_velocities = np.clip(velocities + v1 + v2 + v3, -1, 1).astype(velocities.dtype)
+    new_positions = (positions + new_velocities).astype(positions.dtype)
+
+    # Boundary handling, same as Playground.__handle_borders
+    upper = np.asarray(shape, dtype=positions.dtype) - 1
+    new_positions = np.where(new_positions < 0, upper, new_positions)
+    new_positions = np.where(new_positions > upper, 0, new_positions)
+
+    return new_positions, new_velocities
+
+
+def in_strip(x: np.ndarray, low: float, high: float, margin: float, width: float) -> np.ndarray:
+    """Checks which x coordinates lie in [low - margin, high + margin) of a periodic axis.
+
+    Args:
+        x (np.ndarray): Coordinates.
+        low (float): Start of the strip.
+        high (float): End of the strip.
+        margin (float): Extra width on both sides.
+        width (float): Period of the axis.
+
+    Returns:
+        np.ndarray: Boolean mask.
+    """
+    return (x - (low - margin)) % width < (high - low) + 2 * margin
+
+
+def _domain_worker(
+    rank, n_workers, n_agents, shape, rule_args, buffer_names, n_steps, start_barrier, step_barrier, done
+):
+    # Attaches to the shared (front, back) position and velocity buffers
+    blocks = [SharedMemory(name=name) for name in buffer_names]
+    positions = [np.ndarray((n_agents, 2), dtype=np.float32, buffer=block.buf) for block in blocks[:2]]
+    velocities = [np.ndarray((n_agents, 2), dtype=np.float32, buffer=block.buf) for block in blocks[2:]]
+    width = shape[0]
+    low, high = rank * width / n_workers, (rank + 1) * width / n_workers
+    halo = max(rule_args[0], rule_args[1])  # radius, separation_radius
+    # The spatial hash only covers the strip and its halo, same arithmetic as
+    # in_strip so every local boid falls inside it
+    if (high - low) + 2 * halo < width:
+        origin, extent = (low - halo, 0), ((high - low) + 2 * halo, shape[1])
+    else:
+        origin, extent = (0, 0), None
+    front = 0
+
+    try:
+        while True:
+            start_barrier.wait()
+            if n_steps.value < 0:
+                break
+            for _ in range(n_steps.value):
+                x = positions[front][:, 0]
+                # Owned boids are the ones inside the strip, so boids crossing
+                # into another strip migrate to that worker on the next step
+                owned = in_strip(x, low, high, 0, width)
+                # Owned boids plus the halo boids near the strip edges, in index
+                # order so the neighbor sums match the single process ones
+                local = np.flatnonzero(in_strip(x, low, high, halo, width))
+                new_positions, new_velocities = flock_step(
+                    positions[front][local], velocities[front][local], shape, *rule_args,
+                    origin=origin, extent=extent,
+                )
+                mine = owned[local]
+                positions[1 - front][local[mine]] = new_positions[mine]
+                velocities[1 - front][local[mine]] = new_velocities[mine]
+                # Everyone finishes writing before the buffers swap
+                step_barrier.wait(BARRIER_TIMEOUT)
+                front = 1 - front
+            done.release()
+    except BaseException:
+        # Wakes up the other workers and the parent instead of leaving them
+        # waiting for this one
+        step_barrier.abort()
+        start_barrier.abort()
+        raise
+    finally:
+        # The views must go before the blocks can be closed
+        del positions, velocities
+        for block in blocks:
+            block.close()
+
+
+def _release_domain(workers: list, blocks: list):
+    # Finalizer of DomainPool, must not hold a reference to the pool. After a
+    # clean close the workers already left, otherwise nobody can stop them
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+        worker.join()
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+@dataclass
+class DomainPool:
+    """
+    Worker processes that share the flock through shared memory.
+
+    The world is split into n_workers strips along x. Every worker updates the
+    boids inside its strip using those boids plus the halo boids within the
+    interaction radius of its edges, and writes them to the back buffer.
+
+    Attributes:
+        shape (tuple[int, int]): World size.
+        n_agents (int): Number of boids.
+        n_workers (int): Number of worker processes / strips.
+        rule_args (tuple): radius, separation_radius, coherence_factor and
+            alignment_factor passed to flock_step.
+    """
+
+    shape: tuple[int, int]
+    n_agents: int
+    n_workers: int
+    rule_args: tuple[float, float, float, float]
+    front: int = field(init=False, default=0)
+    blocks: list[SharedMemory] = field(init=False, repr=False)
+    positions: list[np.ndarray] = field(init=False, repr=False)
+    velocities: list[np.ndarray] = field(init=False, repr=False)
+    workers: list[mp.Process] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        size = max(1, self.n_agents * 2 * np.dtype(np.float32).itemsize)
+        self.blocks = [SharedMemory(create=True, size=size) for _ in range(4)]
+        self.positions = [np.ndarray((self.n_agents, 2), dtype=np.float32, buffer=block.buf) for block in self.blocks[:2]]
+        self.velocities = [np.ndarray((self.n_agents, 2), dtype=np.float32, buffer=block.buf) for block in self.blocks[2:]]
+
+        self.n_steps = mp.Value("q", 0)
+        self.start_barrier = mp.Barrier(self.n_workers + 1)
+        step_barrier = mp.Barrier(self.n_workers)
+        # Released by every worker when it finishes a batch of steps, polled
+        # so a dead worker is noticed however long the batch takes
+        self.done = mp.Semaphore(0)
+        self.workers = [
+            mp.Process(
+                target=_domain_worker,
+                args=(
+                    rank, self.n_workers, self.n_agents, self.shape, self.rule_args,
+                    [block.name for block in self.blocks], self.n_steps,
+                    self.start_barrier, step_barrier, self.done,
+                ),
+                daemon=True,
+            )
+            for rank in range(self.n_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+        # Stops the workers and unlinks the shared memory even if close is never called
+        self.finalizer = weakref.finalize(self, _release_domain, self.workers, self.blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __check_workers(self):
+        failed = [(rank, worker.exitcode) for rank, worker in enumerate(self.workers) if not worker.is_alive()]
+        if failed:
+            self.__release()
+            raise RuntimeError(
+                "Domain workers stopped unexpectedly: "
+                + ", ".join(f"rank {rank} (exit code {exitcode})" for rank, exitcode in failed)
+            )
+
+    def __release(self):
+        # The views must go before the blocks can be closed
+        self.positions, self.velocities = [], []
+        self.finalizer()
+
+    def step(self, positions: np.ndarray, velocities: np.ndarray, n: int = 1):
+        """Advances the flock n steps, positions and velocities are updated in place.
+
+        Args:
+            positions (np.ndarray): (N, 2) positions.
+            velocities (np.ndarray): (N, 2) velocities.
+            n (int, optional): Number of steps. Defaults to 1.
+
+        Raises:
+            RuntimeError: If a worker died, the pool is closed.
+        """
+        if not self.finalizer.alive:
+            raise RuntimeError("DomainPool is closed")
+        self.__check_workers()
+        self.positions[self.front][:] = positions
+        self.velocities[self.front][:] = velocities
+        self.n_steps.value = n
+        try:
+            self.start_barrier.wait(BARRIER_TIMEOUT)
+        except threading.BrokenBarrierError:
+            self.__check_workers()
+            raise
+        for _ in range(self.n_workers):
+            while not self.done.acquire(timeout=WORKER_POLL_INTERVAL):
+                self.__check_workers()
+        self.front = (self.front + n) % 2
+        positions[:] = self.positions[self.front]
+        velocities[:] = self.velocities[self.front]
+
+    def close(self):
+        """Stops the workers and releases the shared memory."""
+        if not self.finalizer.alive:
+            return
+        if all(worker.is_alive() for worker in self.workers) and not self.start_barrier.broken:
+            self.n_steps.value = -1
+            try:
+                self.start_barrier.wait(BARRIER_TIMEOUT)
+            except threading.BrokenBarrierError:
+                pass
+        for worker in self.workers:
+            worker.join(BARRIER_TIMEOUT)
+        # Terminates the stuck workers and unlinks the blocks
+        self.__release()
+
+
+def rasterize(
+    positions: np.ndarray,
+    shape: tuple[int, int],
+    mode: str = "occupancy",
+    velocities: np.ndarray = None,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """Scatters every boid into a grid with a single array operation.
+
+    Args:
+        positions (np.ndarray): (N, 2) positions.
+        shape (tuple[int, int]): World size.
+        mode (str, optional): "occupancy" (uint8 0/1), "count" (boids per
+            cell), "density" (counts scaled to [0, 1]) or "heading" (RGB
+            image, hue is the mean heading of the cell). Defaults to "occupancy".
+        velocities (np.ndarray, optional): (N, 2) velocities, needed by
+            "heading". Defaults to None.
+        out (np.ndarray, optional): Grid reused between frames, allocated if
+            None. Defaults to None.
+
+    Returns:
+        np.ndarray: The grid, `out` if given.
+    """
+    rows = np.clip(positions[:, 0].astype(np.int64), 0, shape[0] - 1)
+    cols = np.clip(positions[:, 1].astype(np.int64), 0, shape[1] - 1)
+    flat_index = rows * shape[1] + cols
+    n_cells = shape[0] * shape[1]
+
+    if mode == "occupancy":
+        if out is None:
+            out = np.zeros(shape=shape, dtype=np.uint8)
+        out.fill(0)
+        out.reshape(-1)[flat_index] = 1
+        return out
+
+    counts = np.bincount(flat_index, minlength=n_cells).reshape(shape)
+    if mode == "count":
+        if out is None:
+            out = np.zeros(shape=shape, dtype=np.int64)
+        out[:] = counts
+        return out
+
+    if mode == "density":
+        if out is None:
+            out = np.zeros(shape=shape, dtype=np.float32)
+        np.divide(counts, max(1, counts.max()), out=out, casting="unsafe")
+        return out
+
+    if mode == "heading":
+        if velocities is None:
+            raise ValueError("heading frames need the velocities")
+        if out is None:
+            out = np.zeros(shape=(*shape, 3), dtype=np.float32)
+        mean_x = np.bincount(flat_index, weights=velocities[:, 0], minlength=n_cells).reshape(shape)
+        mean_y = np.bincount(flat_index, weights=velocities[:, 1], minlength=n_cells).reshape(shape)
+        hsv = np.empty(shape=(*shape, 3), dtype=np.float32)
+        hsv[..., 0] = (np.arctan2(mean_y, mean_x) / (2 * np.pi)) % 1
+        hsv[..., 1] = 1
+        hsv[..., 2] = counts > 0
+        out[:] = hsv_to_rgb(hsv)
+        return out
+
+    raise ValueError(f"Unknown mode {mode!r}")
+
+
+@dataclass
+class FrameSink:
+    """
+    Writes rasterized frames to images or to a raw video stream.
+
+    Attributes:
+        path (str): Either a format string for numbered images, e.g.
+            "frames/boids_{:05d}.png", or a ".raw" file where every frame is
+            appended as uint8 bytes (e.g. for `ffmpeg -f rawvideo`). Integer
+            frames (occupancy, count) are divided by their max and float
+            frames (density, heading) clipped to [0, 1] before scaling to 255.
+        cmap (str): Colormap of single channel frames. Defaults to "viridis".
+    """
+
+    path: str
+    cmap: str = "viridis"
+    n_frames: int = field(init=False, default=0)
+    stream: object = field(init=False, default=None, repr=False)
+
+    def write(self, frame: np.ndarray):
+        if self.path.endswith(".raw"):
+            if self.stream is None:
+                self.stream = open(self.path, "wb")
+            if np.issubdtype(frame.dtype, np.integer) or frame.dtype == bool:
+                frame = frame / max(1, frame.max())
+            frame = (np.clip(frame, 0, 1) * 255).astype(np.uint8)
+            self.stream.write(frame.tobytes())
+        else:
+            plt.imsave(self.path.format(self.n_frames), frame, cmap=self.cmap)
+        self.n_frames += 1
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
 @dataclass
 class Playground:
     shape: tuple[int, int]
     world: np.ndarray = field(init=False)
     n_agents: int = 10
-    agents: list[Boid] = field(init=False, default_factory=lambda: [])
+    agents: BoidViews = field(init=False)
     # Check out Kfish.org/BOIDS/Pseudocode.html
     coherence_factor: float = 8
     separation_radius: float = 2
     alignment_factor: float = 100
+    # Applies the rules to all boids at once with flock_step
+    vectorized: bool = True
+    # Loop engine reads a frozen snapshot of the step instead of the
+    # boids already moved (flock_step is always synchronous)
+    synchronous: bool = False
+    # Seed of the random initial positions and velocities
+    seed: int = None
+    # Worker processes of the vectorized engine, one strip of the world each
+    n_workers: int = 1
+    domain_pool: DomainPool = field(init=False, default=None, repr=False)
+    rng: np.random.Generator = field(init=False, repr=False)
+    # Structure of arrays, agents are Boid views of their rows
+    positions: np.ndarray = field(init=False, repr=False)
+    velocities: np.ndarray = field(init=False, repr=False)
+    # Back buffer written by the synchronous loop engine
+    buffer_positions: np.ndarray = field(init=False, repr=False)
+    buffer_velocities: np.ndarray = field(init=False, repr=False)
+    buffer_agents: BoidViews = field(init=False, repr=False)
+    spatial_hash: SpatialHash = field(init=False, default=None, repr=False)
 
     def __post_init__(self):
+        if self.n_workers > 1 and not self.vectorized:
+            raise ValueError("n_workers > 1 needs the vectorized engine")
+        self.rng = np.random.default_rng(self.seed)
         self.__init_agents()
         self.world = np.zeros(shape=self.shape, dtype=np.uint8)
 
     def __init_agents(self):
-        for _ in range(self.n_agents):
-            # Random positions and velocity
-            x = np.random.uniform(0, self.shape[0])
-            y = np.random.uniform(0, self.shape[1])
-            dx = np.random.uniform(-1, 1)
-            dy = np.random.uniform(-1, 1)
-
-            self.agents.append(
-                Boid(position=np.array([x, y]), velocity=np.array([dx, dy]))
-            )
+        # Random positions and velocities
+        self.positions = self.rng.uniform(low=(0, 0), high=self.shape, size=(self.n_agents, 2)).astype(np.float32)
+        self.velocities = self.rng.uniform(low=-1, high=1, size=(self.n_agents, 2)).astype(np.float32)
+        # Views, updating a boid in place updates the arrays
+        self.agents = BoidViews(self.positions, self.velocities)
+
+        self.buffer_positions = self.positions.copy()
+        self.buffer_velocities = self.velocities.copy()
+        self.buffer_agents = BoidViews(self.buffer_positions, self.buffer_velocities)
 
     def __clear_world(self):
-        # Clears world
-        self.world = np.zeros(shape=self.shape, dtype=np.uint8)
+        # Clears world in place
+        self.world.fill(0)
 
-    def __update_world(self, boid: Boid):
-        self.world[int(boid.position[0]), int(boid.position[1])] = 1
+    def __update_world(self):
+        rasterize(self.positions, self.shape, out=self.world)
 
     def __handle_borders(self, boid: Boid):
         # Out of x bounds
@@ -84,54 +662,67 @@ class Playground:
 
 
     def __cohesion_rule(self, myself: Boid, neighbors: list[Boid]):
-        # print(f"{len(neighbors)=}")
-        new_velocity = np.array([0, 0], dtype=np.float32)
-        for neighbor in neighbors:
-            # print(f"{neighbor.velocity=}")
-            new_velocity += neighbor.velocity
+        # Sums in float64 in index order, like the bincount sums of flock_step,
+        # over the neighbors in the visual range
+        new_velocity = np.zeros(2, dtype=np.float64)
+        n_visible = 0
+        for neighbor, delta in zip(neighbors, self.__neighbor_deltas(myself, neighbors)):
+            visible = np.hypot(delta[0], delta[1]) < myself.radius
+            new_velocity += np.where(visible, neighbor.velocity, 0)
+            n_visible += visible
+        if not n_visible:
+            return np.zeros(2, dtype=np.float64)
 
-        new_velocity = new_velocity / len(neighbors)
+        new_velocity = new_velocity / n_visible
 
         return (new_velocity - myself.velocity) / self.coherence_factor
 
 
     def __align_rule(self, myself: Boid, neighbors: list[Boid]) -> np.ndarray:    
-        new_position = np.array([0, 0], dtype=np.float32)
-        for neighbor in neighbors:
-                new_position += neighbor.position
+        # Center of the neighbors in the visual range relative to myself, across the borders
+        relative_center = np.zeros(2, dtype=np.float64)
+        n_visible = 0
+        for delta in self.__neighbor_deltas(myself, neighbors):
+            visible = np.hypot(delta[0], delta[1]) < myself.radius
+            relative_center += np.where(visible, delta, 0)
+            n_visible += visible
+        if not n_visible:
+            return np.zeros(2, dtype=np.float64)
 
-        new_position = new_position / len(neighbors)
-
-        return (new_position - myself.position) / self.alignment_factor
+        return relative_center / n_visible / self.alignment_factor
 
 
     def __separation_rule(self, myself: Boid, neighbors: list[Boid]):
-        vector_c = np.array([0, 0], dtype=np.float32)
-        for neighbor in neighbors:
-            distance_to_neighbor = self.__distance_to_neighbor(myself, neighbor)
-            # print(f"distance_to_neighbor: {distance_to_neighbor}")
-            if distance_to_neighbor < self.separation_radius:
-                vector_c += (myself.position - neighbor.position)
-                # print(f"{vector_c=}")
-
-        return vector_c
-
-    
-    def __distance_to_neighbor(self, myself: Boid, neighbor: Boid):
-        return np.linalg.norm(myself.position - neighbor.position)
-
-
-    def __count_neighbors(self, myself: Boid) -> list[Boid]:
-        neighbors = []
-        for boid in self.agents:
-            if boid is not myself:
-                # Calculate distance
-                neighbors.append(boid)
-
-        # neighbors = list(filter(
-            # lambda neighbor: True if self.__distance_to_neighbor(myself, neighbor) < self.separation_radius else False,
-            # neighbors,
-        # ))
+        vector_c = np.zeros(2, dtype=np.float64)
+        for delta in self.__neighbor_deltas(myself, neighbors):
+            too_close = np.hypot(delta[0], delta[1]) < self.separation_radius
+            vector_c += np.where(too_close, delta, 0)
+
+        return -vector_c
+
+
+    def __neighbor_deltas(self, myself: Boid, neighbors: list[Boid]) -> np.ndarray:
+        # Wrapped displacements to the neighbors, float64 like SpatialHash.pairs
+        if not neighbors:
+            return np.empty(shape=(0, 2), dtype=np.float64)
+        positions = np.array([neighbor.position for neighbor in neighbors])
+        return wrapped_delta(myself.position, positions, self.shape)
+
+
+    def __build_spatial_hash(self):
+        # Cells as large as the largest interaction radius
+        if self.spatial_hash is None:
+            cell_size = max(Boid.radius, self.separation_radius)
+            self.spatial_hash = SpatialHash(shape=self.shape, cell_size=cell_size)
+        self.spatial_hash.build(self.positions.copy())
+
+
+    def __count_neighbors(self, myself: Boid, index: int) -> list[Boid]:
+        # Candidates come from the cells around myself, those within the
+        # visual or the separation range are kept, the rules filter them
+        indices, _, _ = self.spatial_hash.query(myself.position, max(myself.radius, self.separation_radius))
+        # Index order, so the rules sum the neighbors in a fixed order
+        neighbors = [self.agents[i] for i in np.sort(indices) if i != index]
         # print(f"{neighbors=}")
         # print(f"{len(neighbors)=}")
         return neighbors
@@ -140,9 +731,12 @@ class Playground:
         boid.position += np.array([1, 1])
         self.__handle_borders(boid)
 
-    def __move_agents(self, boid):
+    def __move_agents(self, index: int, new_boid: Boid = None):
+        boid = self.agents[index]
+        # The result is written to new_boid, boid itself by default
+        new_boid = boid if new_boid is None else new_boid
         # Counts neighbors
-        neighbors = self.__count_neighbors(boid)
+        neighbors = self.__count_neighbors(boid, index)
         # self.check_collision(boid, neighbors)
         # Applys rules and calculates velocity
         v1 = self.__separation_rule(boid, neighbors)
@@ -151,15 +745,15 @@ class Playground:
 
         # Updates velocity and position
         # print(f"{boid.position=}")
-        boid.velocity += v1 + v2 + v3
-        boid.velocity = np.clip(boid.velocity, -1, 1)
+        # Clipped in float64 and then stored as float32, like flock_step
+        new_boid.velocity[:] = np.clip(boid.velocity + v1 + v2 + v3, -1, 1)
         # print(f"{boid.velocity=}")
         # boid.velocity += v1
-        boid.position += boid.velocity
+        new_boid.position[:] = boid.position + new_boid.velocity
         # print(f"{boid.position=}")
 
         # Boundary handling
-        self.__handle_borders(boid)
+        self.__handle_borders(new_boid)
 
     def __show_world(self):
         state_to_char = " *"
@@ -181,15 +775,124 @@ class Playground:
             if np.all(myself.position == neighbor.position):
                 print("COLLISION DETECTED")
 
+    def __vectorized_step(self):
+        positions, velocities = flock_step(
+            self.positions,
+            self.velocities,
+            self.shape,
+            radius=Boid.radius,
+            separation_radius=self.separation_radius,
+            coherence_factor=self.coherence_factor,
+            alignment_factor=self.alignment_factor,
+        )
+        # In place, so the Boid views stay valid
+        self.positions[:] = positions
+        self.velocities[:] = velocities
+
+    def __parallel_step(self, n: int):
+        if self.domain_pool is None:
+            self.domain_pool = DomainPool(
+                shape=self.shape,
+                n_agents=self.n_agents,
+                n_workers=self.n_workers,
+                rule_args=(Boid.radius, self.separation_radius, self.coherence_factor, self.alignment_factor),
+            )
+        self.domain_pool.step(self.positions, self.velocities, n)
+
+    def close(self):
+        """Stops the worker processes, if any."""
+        if self.domain_pool is not None:
+            self.domain_pool.close()
+            self.domain_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __synchronous_step(self):
+        # Reads the current boids and writes the back buffer
+        self.__build_spatial_hash()
+        for index, new_boid in enumerate(self.buffer_agents):
+            self.__move_agents(index, new_boid)
+        # Copies instead of swapping, so the Boid views stay valid
+        self.positions[:] = self.buffer_positions
+        self.velocities[:] = self.buffer_velocities
+
+    def step(self, n: int = 1):
+        """Advances the simulation n steps without rendering.
+
+        Args:
+            n (int, optional): Number of steps. Defaults to 1.
+        """
+        if self.vectorized and self.n_workers > 1:
+            self.__parallel_step(n)
+            return
+
+        for _ in range(n):
+            if self.vectorized:
+                self.__vectorized_step()
+            elif self.synchronous:
+                self.__synchronous_step()
+            else:
+                # Neighbors are found with the positions at the start of the step
+                self.__build_spatial_hash()
+                # Updates boids
+                for index in range(self.n_agents):
+                    # Apply rules to obtain velocities modifications
+                    # Apply velocity and update positions
+                    self.__move_agents(index)
+                    # self.__simple_movement(boid)
+
+    def run(self, steps: int, record_every: int = 1) -> np.ndarray:
+        """Runs the simulation headless and records the positions.
+
+        Args:
+            steps (int): Number of steps.
+            record_every (int, optional): Steps between records. Defaults to 1.
+
+        Returns:
+            np.ndarray: (steps // record_every + 1, n_agents, 2) positions,
+            the first record is the initial state.
+        """
+        trajectory = np.empty(
+            shape=(steps // record_every + 1, self.n_agents, 2), dtype=self.positions.dtype
+        )
+        trajectory[0] = self.positions
+        for record in range(1, len(trajectory)):
+            self.step(record_every)
+            trajectory[record] = self.positions
+        # Steps left after the last record
+        self.step(steps % record_every)
+
+        return trajectory
+
+    def render(self, mode: str = "density", out: np.ndarray = None) -> np.ndarray:
+        """Rasterizes the current boids, see rasterize for the modes."""
+        return rasterize(self.positions, self.shape, mode=mode, velocities=self.velocities, out=out)
+
+    def record_frames(self, steps: int, sink: FrameSink, mode: str = "density", every: int = 1):
+        """Runs headless and writes a frame every `every` steps to a sink.
+
+        Args:
+            steps (int): Number of steps.
+            sink (FrameSink): Where the frames go.
+            mode (str, optional): Rasterization mode. Defaults to "density".
+            every (int, optional): Steps between frames. Defaults to 1.
+        """
+        frame = self.render(mode)
+        sink.write(frame)
+        for _ in range(steps // every):
+            self.step(every)
+            # The frame buffer is reused
+            sink.write(self.render(mode, out=frame))
+        sink.close()
+
     def run_simulation(self):
         while True:
-            # Updates boids
-            for boid in self.agents:
-                # Apply rules to obtain velocities modifications
-                # Apply velocity and update positions
-                self.__move_agents(boid)
-                # self.__simple_movement(boid)
-                self.__update_world(boid)
+            self.step()
+            self.__update_world()
             # Prints world
             self.__show_world()
             sleep(0.1)
@@ -198,6 +901,195 @@ class Playground:
             self.__clear_screen()
 
 
+def measure_throughput(playground: Playground, steps: int = 100) -> float:
+    """Boid updates per second of a headless run.
+
+    Args:
+        playground (Playground): Simulation to advance.
+        steps (int, optional): Number of steps. Defaults to 100.
+
+    Returns:
+        float: n_agents * steps / elapsed seconds.
+    """
+    start = perf_counter()
+    playground.step(steps)
+    elapsed = perf_counter() - start
+
+    return playground.n_agents * steps / elapsed
+
+
+def benchmark_domains(
+    n_agents: int = 1_000_000,
+    shape: tuple[int, int] = (6000, 6000),
+    workers: tuple[int, ...] = (1, 2, 4, 8, 16, 32),
+    steps: int = 10,
+) -> dict[int, float]:
+    """Boid updates per second of the domain decomposition for several worker counts.
+
+    Args:
+        n_agents (int, optional): Number of boids. Defaults to 1_000_000.
+        shape (tuple[int, int], optional): World size. Defaults to (6000, 6000).
+        workers (tuple[int, ...], optional): Worker counts. Defaults to (1, 2, 4, 8, 16, 32).
+        steps (int, optional): Timed steps per worker count. Defaults to 10.
+
+    Returns:
+        dict[int, float]: Boid updates per second for each worker count.
+    """
+    results = {}
+    for n_workers in workers:
+        with Playground(shape=shape, n_agents=n_agents, seed=0, n_workers=n_workers) as playground:
+            # Warm up, starts the workers
+            playground.step()
+            results[n_workers] = measure_throughput(playground, steps)
+        print(
+            f"{n_workers:>2} workers: {results[n_workers]:.3e} boid updates/s, "
+            f"speedup {results[n_workers] / results[workers[0]]:.2f}"
+        )
+
+    return results
+
+
+def flock_metrics(positions: np.ndarray, velocities: np.ndarray, shape: tuple[int, int], radius: float = Boid.radius) -> dict[str, float]:
+    """Order metrics of a flock.
+
+    Args:
+        positions (np.ndarray): (N, 2) positions.
+        velocities (np.ndarray): (N, 2) velocities.
+        shape (tuple[int, int]): World size.
+        radius (float, optional): Distance that links two boids of a cluster.
+            Defaults to Boid.radius.
+
+    Returns:
+        dict[str, float]: polarization (norm of the mean heading, 1 when
+        aligned), number of clusters and mean nearest neighbor distance.
+    """
+    speed = np.hypot(velocities[:, 0], velocities[:, 1])[:, None]
+    headings = velocities / np.where(speed > 0, speed, 1)
+    polarization = float(np.hypot(*headings.mean(axis=0)))
+
+    spatial_hash = SpatialHash(shape=shape, cell_size=radius)
+    spatial_hash.build(positions)
+    i, j, _, _ = spatial_hash.pairs(radius)
+    adjacency = coo_matrix((np.ones(len(i)), (i, j)), shape=(len(positions), len(positions)))
+    n_clusters, _ = connected_components(adjacency, directed=False)
+
+    # Periodic tree, the world wraps around like the boids do
+    tree = cKDTree(np.mod(positions, shape), boxsize=shape)
+    distance, _ = tree.query(np.mod(positions, shape), k=2)
+
+    return {
+        "polarization": polarization,
+        "n_clusters": float(n_clusters),
+        "nearest_neighbor_distance": float(distance[:, 1].mean()),
+    }
+
+
+def run_metrics(config: dict, steps: int = 1000, metric_every: int = 10) -> dict:
+    """Runs one configuration headless and averages its metrics over time.
+
+    Only running sums are kept, the trajectory is never stored.
+
+    Args:
+        config (dict): Playground keyword arguments.
+        steps (int, optional): Number of steps. Defaults to 1000.
+        metric_every (int, optional): Steps between metric samples. Defaults to 10.
+
+    Returns:
+        dict: The configuration, the time averaged metrics (mean_*) and the
+        metrics of the final state (final_*).
+    """
+    totals = {}
+    n_samples = 0
+    with Playground(**config) as playground:
+        for _ in range(steps // metric_every):
+            playground.step(metric_every)
+            metrics = flock_metrics(playground.positions, playground.velocities, playground.shape)
+            for name, value in metrics.items():
+                totals[name] = totals.get(name, 0.0) + value
+            n_samples += 1
+        # The steps left over after the last sample
+        if steps % metric_every:
+            playground.step(steps % metric_every)
+        metrics = flock_metrics(playground.positions, playground.velocities, playground.shape)
+
+    if n_samples == 0:
+        totals, n_samples = dict(metrics), 1
+
+    result = {key: value for key, value in config.items() if key != "shape"}
+    result["shape"] = "x".join(str(side) for side in playground.shape)
+    result.update({f"mean_{name}": total / n_samples for name, total in totals.items()})
+    result.update({f"final_{name}": value for name, value in metrics.items()})
+
+    return result
+
+
+def _run_metrics_star(args):
+    return run_metrics(*args)
+
+
+def sweep_grid(
+    coherence_factors: list[float],
+    separation_radii: list[float],
+    alignment_factors: list[float],
+    **common,
+) -> list[dict]:
+    """Playground configurations for every combination of the parameters.
+
+    Args:
+        coherence_factors (list[float]): coherence_factor values.
+        separation_radii (list[float]): separation_radius values.
+        alignment_factors (list[float]): alignment_factor values.
+        **common: Keyword arguments shared by every configuration, e.g. shape.
+
+    Returns:
+        list[dict]: Playground keyword arguments.
+    """
+    return [
+        dict(common, coherence_factor=coherence, separation_radius=separation, alignment_factor=alignment)
+        for coherence, separation, alignment in product(coherence_factors, separation_radii, alignment_factors)
+    ]
+
+
+def sweep(
+    configs: list[dict],
+    output: str = "boids_sweep.csv",
+    steps: int = 1000,
+    metric_every: int = 10,
+    n_processes: int = None,
+) -> str:
+    """Runs many configurations in a process pool and streams their metrics to a CSV file.
+
+    Rows are written as soon as each configuration finishes, in completion order.
+
+    Args:
+        configs (list[dict]): Playground keyword arguments, e.g. from sweep_grid.
+        output (str, optional): CSV file. Defaults to "boids_sweep.csv".
+        steps (int, optional): Steps per configuration. Defaults to 1000.
+        metric_every (int, optional): Steps between metric samples. Defaults to 10.
+        n_processes (int, optional): Pool size, all cores if None. Defaults to None.
+
+    Returns:
+        str: The output file.
+
+    Raises:
+        ValueError: If a configuration has n_workers > 1, pool processes cannot
+            start the DomainPool workers.
+    """
+    if any(config.get("n_workers", 1) > 1 for config in configs):
+        raise ValueError("sweep runs every configuration in one process, n_workers must be 1")
+    tasks = [(config, steps, metric_every) for config in configs]
+    with mp.Pool(processes=n_processes) as pool, open(output, "w", newline="") as csv_file:
+        writer = None
+        for result in pool.imap_unordered(_run_metrics_star, tasks):
+            if writer is None:
+                writer = csv.DictWriter(csv_file, fieldnames=list(result))
+                writer.writeheader()
+            writer.writerow(result)
+            csv_file.flush()
+
+    return output
+
+
 def main():
     playground = Playground(shape=(50, 50), n_agents=50)
     playground.run_simulation()
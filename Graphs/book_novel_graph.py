@@ -12,58 +12,735 @@ License: MIT License
 Description: 
 '''
 
+import argparse
+import hashlib
 import json
+import math
+import os
+from dataclasses import dataclass
+from typing import Union
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import networkx as nx
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 
+METRICS_CACHE = "./Graphs/metrics_cache.json"
+LAYOUT_CACHE = "./Graphs/layout_cache.json"
+EDGE_LIST = "./Graphs/edge_list"  # Binary edge list written by extract_characters_information
+DIRECT_REPULSION_NODES = 256  # Below this size repulsion is computed exactly
+GRAVITY = 1.0  # Pull toward the centroid, keeps disconnected components in view
 
 
-def main():
-    # Load dictionary
-    with open("./Graphs/related_names.json", 'r') as json_file:
-        data = json.load(json_file)
+def file_hash(path: str) -> str:
+    """SHA-256 of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-    with open("./Graphs/name_counts.json", 'r') as json_file:
-        node_sizes = json.load(json_file)
 
+def edge_list_hash(directory: str) -> str:
+    """SHA-256 of the files of a binary edge list (see load_edge_list)."""
+    digest = hashlib.sha256()
+    for file_name in ("names.txt", "counts.npy", "src.npy", "dst.npy", "weight.npy"):
+        digest.update(file_hash(os.path.join(directory, file_name)).encode())
+    return digest.hexdigest()
 
-    # Creates directed graph
-    G = nx.Graph()
 
-    for character in data:
-        G.add_node(character)
+def betweenness_pivots(n_nodes: int, error: float, confidence: float = 0.95) -> int:
+    """Pivots needed to estimate normalized betweenness within an additive error.
 
-    for character, relationships in data.items():
-        for related_character, count in relationships.items():
-            G.add_edge(character, related_character, weight=count)
+    Every pivot contributes a sample in [0, n / (n - 1)] to the estimate, so
+    Hoeffding's inequality with a union bound over the nodes gives
+    k = (n / (n - 1))^2 ln(2 n / (1 - confidence)) / (2 error^2).
+
+    Args:
+        n_nodes (int): number of nodes.
+        error (float): maximum absolute error of every node.
+        confidence (float): probability of staying within the error. Defaults to 0.95.
+
+    Returns:
+        int: number of pivots, n_nodes means the exact computation.
+    """
+    if n_nodes < 2:
+        return n_nodes
+    sample_range = n_nodes / (n_nodes - 1)
+    k = math.ceil(sample_range**2 * math.log(2 * n_nodes / (1 - confidence)) / (2 * error**2))
+    return min(k, n_nodes)
+
+
+def graph_metrics(
+    G: Union[nx.Graph, "CharacterGraph"],
+    graph_key: str,
+    cache_file: str = METRICS_CACHE,
+    betweenness_error: float = None,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> dict:
+    """Graph properties, reusing the cached ones whose inputs did not change.
+
+    Every metric is stored with a key made of the graph key (e.g. the hash of
+    related_names.json) and its own parameters, and only recomputed when that
+    key changes. A CharacterGraph computes its metrics on the CSR matrix and
+    is exported to networkx only for the betweenness centrality, and only
+    when it is not cached.
+
+    Args:
+        G (nx.Graph | CharacterGraph): character graph.
+        graph_key (str): identifies the graph contents.
+        cache_file (str): JSON cache. Defaults to METRICS_CACHE.
+        betweenness_error (float): additive error of the sampled betweenness,
+            exact if None. Defaults to None.
+        confidence (float): confidence of the error bound. Defaults to 0.95.
+        seed (int): seed of the pivot sampling. Defaults to 0.
+
+    Returns:
+        dict: graph properties.
+    """
+    if betweenness_error is None:
+        pivots = None
+    else:
+        pivots = betweenness_pivots(G.number_of_nodes(), betweenness_error, confidence)
+        if pivots >= G.number_of_nodes():
+            pivots = None  # Sampling every node is the exact computation
+
+    if isinstance(G, CharacterGraph):
+        metrics = {
+            "Number_of_nodes": (lambda: int(G.number_of_nodes()), None),
+            "Number_of_edges": (lambda: int(G.number_of_edges()), None),
+            "Degrees_of_nodes": (lambda: G.degrees().tolist(), None),
+            "Density": (lambda: float(G.density()), None),
+            "Number_of_connected_components": (lambda: int(G.number_connected_components()), None),
+            "Clustering_coefficient": (lambda: dict(zip(G.names, G.clustering().tolist())), None),
+        }
+        to_networkx = G.to_networkx
+    else:
+        metrics = {
+            "Number_of_nodes": (lambda: G.number_of_nodes(), None),
+            "Number_of_edges": (lambda: G.number_of_edges(), None),
+            "Degrees_of_nodes": (lambda: [G.degree(node) for node in G.nodes()], None),
+            "Density": (lambda: nx.density(G), None),
+            "Number_of_connected_components": (lambda: nx.number_connected_components(G), None),
+            "Clustering_coefficient": (lambda: nx.clustering(G), None),
+            # graph_properties["Eccentricity"] = nx.eccentricity(G)  # Not possible because graph is not connected
+        }
+        to_networkx = lambda: G
+
+    metrics.update({
+        "Betweenness_centrality": (
+            lambda: nx.betweenness_centrality(to_networkx(), k=pivots, seed=seed),
+            None if pivots is None else {"k": pivots, "seed": seed},
+        ),
+        # graph_properties["Diameter"] = nx.diameter(G)  # Not possible because graph is not connected
+    })
+
+    cache = {}
+    if os.path.exists(cache_file):
+        with open(cache_file, 'r') as json_file:
+            cache = json.load(json_file)
+
+    graph_properties = {}
+    for name, (compute, params) in metrics.items():
+        key = f"{graph_key}:{json.dumps(params, sort_keys=True)}"
+        if name not in cache or cache[name]["key"] != key:
+            cache[name] = {"key": key, "value": compute()}
+        graph_properties[name] = cache[name]["value"]
+
+    with open(cache_file, 'w') as json_file:
+        json.dump(cache, json_file)
+
+    return graph_properties
+
+
+def load_edge_list(directory: str = EDGE_LIST) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Loads a binary edge list written by extract_characters_information.save_edge_list.
+
+    The columns are memory mapped, nothing is read until it is used.
+
+    Args:
+        directory (str): edge list directory. Defaults to EDGE_LIST.
+
+    Returns:
+        tuple: names, name counts, src ids, dst ids and weights.
+    """
+    with open(os.path.join(directory, "names.txt"), 'r', encoding='utf-8') as names_file:
+        names = names_file.read().splitlines()
+    columns = [
+        np.load(os.path.join(directory, f"{column}.npy"), mmap_mode='r')
+        for column in ("counts", "src", "dst", "weight")
+    ]
+    return (names, *columns)
+
+
+@dataclass
+class CharacterGraph:
+    """Undirected weighted character graph stored as a CSR adjacency matrix.
+
+    Args:
+        names (list[str]): node names, row i of the matrix is names[i].
+        adjacency (sparse.csr_matrix): symmetric (n, n) matrix of edge weights.
+    """
+
+    names: list[str]
+    adjacency: sparse.csr_matrix
+
+    @classmethod
+    def from_related_names(cls, data: dict[str, dict[str, int]]) -> "CharacterGraph":
+        """Builds the matrix straight from a related_names dictionary.
+
+        Both directions of a relationship become one undirected edge. If their
+        counts differ, the one that comes last in the dictionary wins, like
+        with nx.Graph.add_edge in main.
+        """
+        # Interns the names in the same order as the networkx graph of main
+        name_ids = {character: idx for idx, character in enumerate(data)}
+        for relationships in data.values():
+            for related_character in relationships:
+                name_ids.setdefault(related_character, len(name_ids))
+
+        edges = {}
+        for character, relationships in data.items():
+            row = name_ids[character]
+            for related_character, count in relationships.items():
+                col = name_ids[related_character]
+                edges[min(row, col), max(row, col)] = count
+
+        rows = np.array([row for row, _ in edges], dtype=np.int64)
+        cols = np.array([col for _, col in edges], dtype=np.int64)
+        weights = np.array(list(edges.values()), dtype=np.float64)
+        # Both triangles, self loops only once
+        mirror = rows != cols
+        n_nodes = len(name_ids)
+        adjacency = sparse.coo_matrix(
+            (
+                np.concatenate((weights, weights[mirror])),
+                (np.concatenate((rows, cols[mirror])), np.concatenate((cols, rows[mirror]))),
+            ),
+            shape=(n_nodes, n_nodes),
+        ).tocsr()
+        adjacency.eliminate_zeros()
+
+        return cls(names=list(name_ids), adjacency=adjacency)
+
+    @classmethod
+    def from_edge_list(
+        cls, names: list[str], src: np.ndarray, dst: np.ndarray, weight: np.ndarray
+    ) -> "CharacterGraph":
+        """Builds the matrix from columns of unordered pairs, e.g. from load_edge_list.
+
+        Names without edges are dropped, like in related_names.json.
+        """
+        used = np.union1d(src, dst)
+        rows = np.searchsorted(used, src)
+        cols = np.searchsorted(used, dst)
+        n_nodes = len(used)
+        adjacency = sparse.coo_matrix(
+            (np.concatenate((weight, weight)).astype(np.float64), (np.concatenate((rows, cols)), np.concatenate((cols, rows)))),
+            shape=(n_nodes, n_nodes),
+        ).tocsr()
+        return cls(names=[names[name_id] for name_id in used], adjacency=adjacency)
+
+    def to_related_names(self) -> dict[str, dict[str, int]]:
+        """Exports the edges as a related_names dictionary."""
+        related_names = {}
+        for row, name in enumerate(self.names):
+            start, end = self.adjacency.indptr[row], self.adjacency.indptr[row + 1]
+            related_names[name] = {
+                self.names[col]: int(weight)
+                for col, weight in zip(self.adjacency.indices[start:end], self.adjacency.data[start:end])
+            }
+        return related_names
+
+    def number_of_nodes(self) -> int:
+        return self.adjacency.shape[0]
+
+    def number_of_edges(self) -> int:
+        # Self loops are stored once, the other edges twice
+        n_loops = np.count_nonzero(self.adjacency.diagonal())
+        return (self.adjacency.nnz - n_loops) // 2 + n_loops
+
+    def degrees(self) -> np.ndarray:
+        # Self loops count twice, like in networkx
+        return np.diff(self.adjacency.indptr) + (self.adjacency.diagonal() != 0)
+
+    def density(self) -> float:
+        n_nodes = self.number_of_nodes()
+        if n_nodes < 2:
+            return 0.0
+        return 2 * self.number_of_edges() / (n_nodes * (n_nodes - 1))
+
+    def number_connected_components(self) -> int:
+        n_components, _ = connected_components(self.adjacency, directed=False)
+        return n_components
+
+    def clustering(self) -> np.ndarray:
+        """Unweighted clustering coefficient of every node, triangles from (A @ A) * A."""
+        binary = (self.adjacency != 0).astype(np.float64)
+        binary.setdiag(0)
+        binary.eliminate_zeros()
+        triangles = np.asarray((binary @ binary).multiply(binary).sum(axis=1)).ravel() / 2
+        degrees = np.diff(binary.indptr)
+        possible = degrees * (degrees - 1) / 2
+        return np.divide(triangles, possible, out=np.zeros_like(triangles), where=possible > 0)
+
+    def to_networkx(self) -> nx.Graph:
+        """Exports the graph, edge weights as the 'weight' attribute."""
+        G = nx.Graph()
+        G.add_nodes_from(self.names)
+        upper = sparse.triu(self.adjacency).tocoo()
+        G.add_weighted_edges_from(
+            (self.names[row], self.names[col], weight.item())
+            for row, col, weight in zip(upper.row, upper.col, upper.data)
+        )
+        return G
+
+
+@dataclass
+class CharacterTimeline:
+    """Character graphs of the time windows of a book, stored as sparse deltas.
+
+    Entry e of the columns is a pair count of window w for
+    window_ptr[w] <= e < window_ptr[w + 1]. The running sum of every pair over
+    the windows is precomputed, so the graph of any range of windows is the
+    difference of two prefix sums.
+
+    Args:
+        names (list[str]): name table, ids of src and dst index it.
+        window_ptr (np.ndarray): (windows + 1,) offsets of the windows.
+        src (np.ndarray): first name id of every entry.
+        dst (np.ndarray): second name id of every entry.
+        weight (np.ndarray): count of the pair in the window.
+    """
+
+    names: list[str]
+    window_ptr: np.ndarray
+    src: np.ndarray
+    dst: np.ndarray
+    weight: np.ndarray
+
+    def __post_init__(self) -> None:
+        n_windows = self.n_windows
+        windows = np.repeat(np.arange(n_windows), np.diff(self.window_ptr))
+        pairs = self.src.astype(np.int64) * len(self.names) + self.dst
+        # Entries sorted by pair, then by window, with the running sum of every pair
+        order = np.lexsort((windows, pairs))
+        pairs, weights = pairs[order], np.asarray(self.weight)[order]
+        self._keys = pairs * n_windows + windows[order]
+        starts = np.flatnonzero(np.diff(pairs, prepend=-1) != 0)
+        prefix = np.cumsum(weights)
+        # Restarts the running sum at the first entry of every pair
+        offsets = prefix[starts] - weights[starts]
+        self._prefix = prefix - np.repeat(offsets, np.diff(np.append(starts, len(pairs))))
+        self._pairs = pairs[starts]
+
+    @property
+    def n_windows(self) -> int:
+        return len(self.window_ptr) - 1
+
+    def prefix_weights(self, end: int) -> np.ndarray:
+        """Counts of every pair over windows [0, end), in the order of the pairs."""
+        position = np.searchsorted(self._keys, self._pairs * self.n_windows + end) - 1
+        found = position >= 0
+        found[found] = self._keys[position[found]] // self.n_windows == self._pairs[found]
+        return np.where(found, self._prefix[np.maximum(position, 0)], 0)
+
+    def graph(self, start: int = 0, end: int = None) -> CharacterGraph:
+        """Graph of the co-occurrences of windows [start, end).
+
+        Args:
+            start (int): first window. Defaults to 0.
+            end (int): window after the last one, all the windows if None. Defaults to None.
+        """
+        end = self.n_windows if end is None else end
+        weights = self.prefix_weights(end) - self.prefix_weights(start)
+        keep = weights != 0
+        src, dst = np.divmod(self._pairs[keep], len(self.names))
+        return CharacterGraph.from_edge_list(self.names, src, dst, weights[keep])
+
+    def cumulative_metrics(self) -> list[dict]:
+        """Properties of the graph of windows [0, w] for every window w.
+
+        Computed incrementally from the deltas: an edge is new the first time
+        its pair appears, and connected components are tracked with a
+        union-find, so the whole sequence costs about one pass over the
+        entries. Nodes are the names with at least one edge, like in
+        related_names.json.
+        """
+        n_names = len(self.names)
+        parent = np.arange(n_names)
+        active = np.zeros(n_names, dtype=bool)
+        seen = set()
+        n_nodes = n_edges = n_components = 0
+        total_weight = 0
+
+        def find(node: int) -> int:
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        metrics = []
+        for window in range(self.n_windows):
+            start, end = self.window_ptr[window], self.window_ptr[window + 1]
+            for src, dst, weight in zip(
+                self.src[start:end].tolist(), self.dst[start:end].tolist(), self.weight[start:end].tolist()
+            ):
+                total_weight += weight
+                if (src, dst) in seen:
+                    continue
+                seen.add((src, dst))
+                n_edges += 1
+                for node in (src, dst):
+                    if not active[node]:
+                        active[node] = True
+                        n_nodes += 1
+                        n_components += 1
+                root_src, root_dst = find(src), find(dst)
+                if root_src != root_dst:
+                    parent[root_src] = root_dst
+                    n_components -= 1
+            metrics.append({
+                "Number_of_nodes": n_nodes,
+                "Number_of_edges": n_edges,
+                "Density": 2 * n_edges / (n_nodes * (n_nodes - 1)) if n_nodes > 1 else 0.0,
+                "Number_of_connected_components": n_components,
+                "Total_weight": total_weight,
+            })
+        return metrics
+
+
+def load_timeline(directory: str = EDGE_LIST) -> CharacterTimeline:
+    """Loads the time windows written by extract_characters_information.save_timeline.
+
+    Args:
+        directory (str): edge list directory. Defaults to EDGE_LIST.
+
+    Returns:
+        CharacterTimeline: the windows, columns memory mapped.
+    """
+    with open(os.path.join(directory, "names.txt"), 'r', encoding='utf-8') as names_file:
+        names = names_file.read().splitlines()
+    window_ptr, src, dst, weight = [
+        np.load(os.path.join(directory, f"window_{column}.npy"), mmap_mode='r')
+        for column in ("ptr", "src", "dst", "weight")
+    ]
+    return CharacterTimeline(names=names, window_ptr=window_ptr, src=src, dst=dst, weight=weight)
+
+
+def _direct_repulsion(positions: np.ndarray, k: float) -> np.ndarray:
+    # All pairs, k^2 / d along the separation
+    delta = positions[:, None, :] - positions[None, :, :]
+    distance2 = np.maximum((delta**2).sum(axis=2), 1e-12)
+    np.fill_diagonal(distance2, np.inf)
+    return k**2 * (delta / distance2[..., None]).sum(axis=1)
+
+
+def _tree_repulsion(positions: np.ndarray, k: float, depth: int) -> np.ndarray:
+    # Quadtree levels as 2^l x 2^l grids over the bounding box. At every level
+    # a node feels the center of mass of the cells that are children of its
+    # parent's neighbors but not its own neighbors (the cells that are far
+    # enough at that level, as in Barnes-Hut), and the nodes of the 3 x 3
+    # neighboring cells of the finest level exactly.
+    n_nodes = len(positions)
+    low = positions.min(axis=0)
+    span = max(float((positions.max(axis=0) - low).max()), 1e-12) * (1 + 1e-9)
+    unit = (positions - low) / span
+    force = np.zeros_like(positions)
+    near = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    children = np.array([(2 * px + cx, 2 * py + cy) for px, py in near for cx in (0, 1) for cy in (0, 1)])
+
+    for level in range(2, depth + 1):
+        side = 2**level
+        cells = np.minimum((unit * side).astype(np.int64), side - 1)
+        keys = cells[:, 0] * side + cells[:, 1]
+        mass = np.bincount(keys, minlength=side**2)
+        center = np.stack(
+            [np.bincount(keys, weights=positions[:, axis], minlength=side**2) for axis in range(2)], axis=1
+        ) / np.maximum(mass, 1)[:, None]
+
+        # (N, 36) children of the parent's neighbors, the near ones are dropped
+        candidate_x = 2 * (cells[:, 0] // 2)[:, None] + children[None, :, 0]
+        candidate_y = 2 * (cells[:, 1] // 2)[:, None] + children[None, :, 1]
+        far = (np.abs(candidate_x - cells[:, 0, None]) > 1) | (np.abs(candidate_y - cells[:, 1, None]) > 1)
+        far &= (candidate_x >= 0) & (candidate_x < side) & (candidate_y >= 0) & (candidate_y < side)
+        node, slot = np.nonzero(far)
+        cell_keys = candidate_x[node, slot] * side + candidate_y[node, slot]
+        occupied = mass[cell_keys] > 0
+        node, cell_keys = node[occupied], cell_keys[occupied]
+
+        delta_x = positions[node, 0] - center[cell_keys, 0]
+        delta_y = positions[node, 1] - center[cell_keys, 1]
+        scale = k**2 * mass[cell_keys] / np.maximum(delta_x**2 + delta_y**2, 1e-12)
+        force[:, 0] += np.bincount(node, weights=scale * delta_x, minlength=n_nodes)
+        force[:, 1] += np.bincount(node, weights=scale * delta_y, minlength=n_nodes)
+
+    # Near field, exact pairs between the 3 x 3 neighboring cells
+    side = 2**depth
+    cells = np.minimum((unit * side).astype(np.int64), side - 1)
+    keys = cells[:, 0] * side + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    cell_start = np.searchsorted(keys[order], np.arange(side**2 + 1))
+    for offset in near:
+        neighbor = cells + offset
+        inside = ((neighbor >= 0) & (neighbor < side)).all(axis=1)
+        neighbor_keys = np.where(inside, neighbor[:, 0] * side + neighbor[:, 1], 0)
+        start = cell_start[neighbor_keys]
+        count = np.where(inside, cell_start[neighbor_keys + 1] - start, 0)
+        i = np.repeat(np.arange(n_nodes), count)
+        first = np.repeat(np.cumsum(count) - count, count)
+        j = order[np.repeat(start, count) + np.arange(count.sum()) - first]
+        i, j = i[i != j], j[i != j]
+        delta_x = positions[i, 0] - positions[j, 0]
+        delta_y = positions[i, 1] - positions[j, 1]
+        scale = k**2 / np.maximum(delta_x**2 + delta_y**2, 1e-12)
+        force[:, 0] += np.bincount(i, weights=scale * delta_x, minlength=n_nodes)
+        force[:, 1] += np.bincount(i, weights=scale * delta_y, minlength=n_nodes)
+
+    return force
+
+
+def force_layout(
+    adjacency: sparse.csr_matrix,
+    initial_positions: np.ndarray = None,
+    iterations: int = 100,
+    weighted: bool = False,
+    seed: int = 0,
+) -> np.ndarray:
+    """Fruchterman-Reingold layout with Barnes-Hut style repulsion.
+
+    Repulsion is computed exactly for small graphs and with a quadtree of
+    2^l x 2^l grids (center of mass of far cells, exact near pairs) above
+    DIRECT_REPULSION_NODES nodes, so an iteration is about O(N log N). A
+    GRAVITY pull toward the centroid stops the components that are not
+    connected to the rest from drifting away.
+
+    Args:
+        adjacency (sparse.csr_matrix): symmetric adjacency matrix.
+        initial_positions (np.ndarray): (N, 2) warm start, e.g. a cached
+            layout. Starts cooler when given. Random if None. Defaults to None.
+        iterations (int): number of iterations. Defaults to 100.
+        weighted (bool): edge attraction proportional to the weights. Defaults to False.
+        seed (int): seed of the random start. Defaults to 0.
+
+    Returns:
+        np.ndarray: (N, 2) positions scaled into the unit square.
+    """
+    n_nodes = adjacency.shape[0]
+    if n_nodes == 0:
+        return np.empty(shape=(0, 2))
+
+    rng = np.random.default_rng(seed)
+    if initial_positions is None:
+        positions = rng.uniform(size=(n_nodes, 2))
+        temperature = 0.1
+    else:
+        positions = np.array(initial_positions, dtype=np.float64)
+        # Small steps, the layout only has to adapt
+        temperature = 0.01
+    k = np.sqrt(1 / n_nodes)
+    cooling = temperature / (iterations + 1)
+
+    upper = sparse.triu(adjacency, k=1).tocoo()
+    weights = upper.data if weighted else np.ones_like(upper.data)
+    depth = max(2, int(np.ceil(np.log(n_nodes / 4) / np.log(4))))
+
+    for _ in range(iterations):
+        if n_nodes <= DIRECT_REPULSION_NODES:
+            displacement = _direct_repulsion(positions, k)
+        else:
+            displacement = _tree_repulsion(positions, k, depth)
+
+        # Attraction along the edges, d^2 / k
+        delta = positions[upper.col] - positions[upper.row]
+        distance = np.sqrt((delta**2).sum(axis=1))
+        attraction = (weights * distance / k)[:, None] * delta
+        for axis in range(2):
+            displacement[:, axis] += np.bincount(upper.row, weights=attraction[:, axis], minlength=n_nodes)
+            displacement[:, axis] -= np.bincount(upper.col, weights=attraction[:, axis], minlength=n_nodes)
+        # Gravity, grows linearly with the distance to the centroid
+        displacement += GRAVITY * (positions.mean(axis=0) - positions)
+
+        # Moves at most `temperature` per iteration
+        length = np.maximum(np.sqrt((displacement**2).sum(axis=1)), 1e-12)
+        positions += displacement / length[:, None] * np.minimum(length, temperature)[:, None]
+        temperature -= cooling
+
+    # Into the unit square, keeping the aspect ratio
+    positions -= positions.min(axis=0)
+    span = positions.max()
+    if span > 0:
+        positions /= span
+    return positions
+
+
+def load_layout(names: list[str], cache_file: str = LAYOUT_CACHE, seed: int = 0) -> np.ndarray:
+    """Cached positions of the nodes to warm start force_layout.
+
+    Nodes missing from the cache start at the center of the cached layout
+    plus some noise. Returns None if there is no cache.
+    """
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file, 'r') as json_file:
+        cached = json.load(json_file)
+    if not cached:
+        return None
+
+    center = np.mean(list(cached.values()), axis=0)
+    rng = np.random.default_rng(seed)
+    return np.array([
+        cached[name] if name in cached else center + rng.normal(scale=0.05, size=2)
+        for name in names
+    ])
+
+
+def save_layout(names: list[str], positions: np.ndarray, cache_file: str = LAYOUT_CACHE) -> None:
+    """Stores the positions of the nodes, see load_layout."""
+    with open(cache_file, 'w') as json_file:
+        json.dump(dict(zip(names, positions.tolist())), json_file)
+
+
+def draw_graph(
+    ax,
+    graph: CharacterGraph,
+    positions: np.ndarray,
+    node_sizes: list[float],
+    with_labels: bool = True,
+    node_color: str = 'lightblue',
+) -> None:
+    """Draws the graph with one collection for the edges and one for the nodes.
+
+    Edge widths are the edge weights.
+    """
+    upper = sparse.triu(graph.adjacency, k=1).tocoo()
+    segments = np.stack((positions[upper.row], positions[upper.col]), axis=1)
+    ax.add_collection(LineCollection(segments, linewidths=upper.data, colors='k', zorder=1))
+    ax.scatter(positions[:, 0], positions[:, 1], s=node_sizes, c=node_color, zorder=2)
+    if with_labels:
+        for name, (x, y) in zip(graph.names, positions):
+            ax.text(x, y, name, ha='center', va='center', fontsize=12, zorder=3)
+    ax.autoscale_view()
+    ax.set_axis_off()
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Reads and process command line arguments.
+
+    Returns:
+        argparse.Namespace: backend, edge list directory, JSON export and
+            betweenness error.
+    """
+    parser = argparse.ArgumentParser(
+        description="Draws the character graph and computes its properties."
+    )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Uses the CSR matrix backend instead of networkx.",
+    )
+    parser.add_argument(
+        "--edge-list",
+        nargs="?",
+        const=EDGE_LIST,
+        default=None,
+        help=f"Loads the binary edge list instead of the JSON files (implies --sparse). "
+        f"Default directory is {EDGE_LIST}",
+    )
+    parser.add_argument(
+        "--export-json",
+        action="store_true",
+        help="Writes related_names.json and name_counts.json from the edge list.",
+    )
+    parser.add_argument(
+        "--betweenness-error",
+        type=float,
+        default=None,
+        help="Samples the betweenness centrality within this additive error (95%% confidence). "
+        "Exact by default.",
+    )
+
+    return parser.parse_args()
+
+
+def main(
+    sparse_backend: bool = False,
+    edge_list: str = None,
+    export_json: bool = False,
+    betweenness_error: float = None,
+):
+    if edge_list is not None:
+        # Memory mapped binary edge list, always with the sparse backend
+        names, counts, src, dst, weight = load_edge_list(edge_list)
+        graph = CharacterGraph.from_edge_list(names, src, dst, weight)
+        node_sizes = dict(zip(names, counts.tolist()))
+        sparse_backend = True
+        if export_json:
+            with open("./Graphs/related_names.json", 'w') as json_file:
+                json.dump(graph.to_related_names(), json_file)
+            with open("./Graphs/name_counts.json", 'w') as json_file:
+                json.dump(node_sizes, json_file)
+    else:
+        # Load dictionary
+        with open("./Graphs/related_names.json", 'r') as json_file:
+            data = json.load(json_file)
+
+        with open("./Graphs/name_counts.json", 'r') as json_file:
+            node_sizes = json.load(json_file)
+
+
+    if sparse_backend:
+        # CSR adjacency matrix, graph_metrics exports it to networkx only if needed
+        if edge_list is None:
+            graph = CharacterGraph.from_related_names(data)
+        G = graph
+    else:
+        # Creates directed graph
+        G = nx.Graph()
+
+        for character in data:
+            G.add_node(character)
+
+        for character, relationships in data.items():
+            for related_character, count in relationships.items():
+                G.add_edge(character, related_character, weight=count)
 
     # Calculate node sizes based on the sum of relationship values
-    node_sizes = [node_sizes.get(node, 1) * 10 for node in G.nodes()]  # Default size is 100 for nodes not in the dict
-    
-    # Extract edge weights from the graph
-    edge_weights = [G[character][target_character]['weight'] for character, target_character in G.edges()]
+    node_sizes = [node_sizes.get(node, 1) * 10 for node in (graph.names if sparse_backend else G.nodes())]  # Default size is 100 for nodes not in the dict
 
-    # Calculate node positions
-    pos = nx.drawing.nx_agraph.graphviz_layout(G)
+    # Calculate node positions, starting from the previous layout if there is one
+    layout_graph = graph if sparse_backend else CharacterGraph.from_related_names(data)
+    initial_positions = load_layout(layout_graph.names)
+    positions = force_layout(layout_graph.adjacency, initial_positions=initial_positions)
+    save_layout(layout_graph.names, positions)
 
-    plt.figure(figsize=(20, 20))
-    nx.draw(G, pos, with_labels=True, node_size=node_sizes, node_color='lightblue', width=edge_weights)
+    fig, ax = plt.subplots(figsize=(20, 20))
+    draw_graph(ax, layout_graph, positions, node_sizes=node_sizes)
     plt.savefig("./Graphs/novel_graph.png")
 
-    # Extract graph properties
-    graph_properties = {}
-    graph_properties["Number_of_nodes"] = G.number_of_nodes()
-    graph_properties["Number_of_edges"] = G.number_of_edges()
-    graph_properties["Degrees_of_nodes"] = [G.degree(node) for node in G.nodes()]
-    graph_properties["Density"] = nx.density(G)
-    graph_properties["Number_of_connected_components"] = nx.number_connected_components(G)
-    graph_properties["Clustering_coefficient"] = nx.clustering(G)
-    # graph_properties["Eccentricity"] = nx.eccentricity(G)  # Not possible because graph is not connected
-    graph_properties["Betweenness_centrality"] = nx.betweenness_centrality(G)
-    # graph_properties["Diameter"] = nx.diameter(G)  # Not possible because graph is not connected
+    # Extract graph properties, cached by the contents of the input files
+    if edge_list is not None:
+        graph_key = edge_list_hash(edge_list)
+    else:
+        graph_key = file_hash("./Graphs/related_names.json")
+    graph_properties = graph_metrics(G, graph_key=graph_key, betweenness_error=betweenness_error)
     with open("./Graphs/graph_properties.json", 'w') as json_file:
         json.dump(graph_properties, json_file)
 
+    # Properties along the book if the edge list has time windows
+    if edge_list is not None and os.path.exists(os.path.join(edge_list, "window_ptr.npy")):
+        timeline = load_timeline(edge_list)
+        with open("./Graphs/timeline_properties.json", 'w') as json_file:
+            json.dump(timeline.cumulative_metrics(), json_file)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_arguments()
+    main(
+        sparse_backend=args.sparse,
+        edge_list=args.edge_list,
+        export_json=args.export_json,
+        betweenness_error=args.betweenness_error,
+    )
\ No newline at end of file
@@ -12,10 +12,16 @@ License: MIT License
 Description: 
 '''
 
+import argparse
 import json
+import mmap
 # import networkx as nx
+import os
 import re
-from collections import defaultdict
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+import numpy as np
 
 CHARACTERS = [
     "Aaron",
@@ -196,93 +202,610 @@ CHARACTERS = [
     "Trapis"
 ]
 
+# Window of the co-occurrences in letter tokens, not whitespace separated
+# words, e.g. "Kvothe’s" is the two tokens "Kvothe" and "s"
 FRIEND_RADIUS = 30
+SHARD_SIZE = 64 * 1024 * 1024  # Bytes per shard in corpus mode
+CHUNK_SIZE = 4 * 1024 * 1024  # Bytes scanned at once by the memory-mapped reader
+EDGE_LIST = "./Graphs/edge_list"  # Binary edge list read by book_novel_graph
 test_char = ["Elodin", "Lorren"]
 
-def main():
-    # Initialize dict of names count
-    name_counts = {name: 0 for name in CHARACTERS}
-
-    # Initialize a defaultdict to store the related names and their counts
-    related_names = defaultdict(lambda: defaultdict(int))
-
-    # Define a regular expression pattern to match complete names
-    name_pattern = r'\b(?:' + '|'.join(re.escape(name) + r's?' for name in CHARACTERS) + r')\b'
-
-    # Initialize a buffer to store words from the previous line
-    line_buffer = []
-
-    # translation table to remove special characters
-
-    # Read txt book file
-    with open("./Graphs/example_text.txt", 'r') as book_file:
-        for idx, line in enumerate(book_file):
-            # print(f"Line: {idx}")
-            # Guarda los matches
-            # print(line)
-            # line = line.translate(translation_table)
-            matches = re.findall(name_pattern, line)
-            line = line.split() # Eliminamos espacios
-            # line = [word.replace("’s", "") for word in line] # Eliminamos las 's
-            # line = [word.replace("’", "") for word in line] # Eliminamos las 's
-
-            # Update counter
-            for name in matches:
-                print(f"{name=}")
-                # print(line)
-                # Increment the count for the current name occurrence
-                name_counts[name.capitalize()] += 1
-                # Look for the index of the name in the sentence
-                for i, word in enumerate(line):
-                    if name in word:
-                        name_index = i
+# Words are runs of letters, so "Kvothe’s" or "Kvothe," give the token "Kvothe"
+TOKEN_PATTERN = re.compile(r"[^\W\d_]+")
+# Lines that start a chapter, e.g. "CHAPTER ONE"
+CHAPTER_PATTERN = r"^\s*CHAPTER\b"
+
+
+@dataclass
+class NameScanner:
+    """Finds character names in a line with one tokenization and hashed lookups.
+
+    Single word names (and their plural with a trailing 's') are looked up in
+    a dict, names of several words (and their plural, e.g. "High Kings") are
+    checked only when their first word appears.
+
+    Args:
+        names (list[str]): character names.
+    """
+
+    names: list[str]
+    single: dict[str, str] = field(init=False, default_factory=dict)
+    multiple: dict[str, list[tuple[tuple[str, ...], str]]] = field(init=False, default_factory=dict)
+
+    def __post_init__(self) -> None:
+        for name in self.names:
+            words = tuple(TOKEN_PATTERN.findall(name))
+            if len(words) == 1:
+                self.single[words[0]] = name
+                self.single.setdefault(words[0] + "s", name)
+            else:
+                plural = words[:-1] + (words[-1] + "s",)
+                self.multiple.setdefault(words[0], []).extend([(words, name), (plural, name)])
+
+    def tokenize(self, line: str) -> list[str]:
+        """Splits a line into word tokens."""
+        return TOKEN_PATTERN.findall(line)
+
+    def scan(self, tokens: list[str]) -> list[tuple[int, str]]:
+        """Finds the names in a list of tokens.
+
+        Args:
+            tokens (list[str]): tokens of a line.
+
+        Returns:
+            list[tuple[int, str]]: (token index, name) of every occurrence.
+        """
+        matches = []
+        single = self.single
+        multiple = self.multiple
+        for index, token in enumerate(tokens):
+            if token in multiple:
+                for words, name in multiple[token]:
+                    if tuple(tokens[index:index + len(words)]) == words:
+                        matches.append((index, name))
                         break
-                # print(name)
+                else:
+                    if token in single:
+                        matches.append((index, single[token]))
+            elif token in single:
+                matches.append((index, single[token]))
+        return matches
+
+
+@dataclass
+class CooccurrenceCounter:
+    """Counts names and co-occurrences over a stream of tokenized lines.
+
+    A name co-occurs with every other name less than `radius` tokens before
+    it, also across line and paragraph boundaries. Only the names of the last
+    `radius` tokens are kept, and pair counts are stored once per unordered
+    pair, so memory does not grow with the length of the book.
+
+    Args:
+        names (list[str]): character names.
+        radius (int): window size in tokens. Defaults to FRIEND_RADIUS.
+    """
+
+    names: list[str]
+    radius: int = FRIEND_RADIUS
+    name_ids: dict[str, int] = field(init=False)
+    counts: list[int] = field(init=False)
+    pair_counts: dict[int, int] = field(init=False, default_factory=lambda: defaultdict(int))
+    window: deque = field(init=False, default_factory=deque)
+    position: int = field(init=False, default=0)
+
+    def __post_init__(self) -> None:
+        self.name_ids = {name: name_id for name_id, name in enumerate(self.names)}
+        self.counts = [0] * len(self.names)
+
+    def add(self, n_tokens: int, matches: list[tuple[int, str]]) -> None:
+        """Adds a line.
+
+        Args:
+            n_tokens (int): number of tokens of the line.
+            matches (list[tuple[int, str]]): (token index, name) of the line,
+                e.g. from NameScanner.scan.
+        """
+        n_names = len(self.names)
+        window = self.window
+        for index, name in matches:
+            name_id = self.name_ids[name]
+            token_position = self.position + index
+            self.counts[name_id] += 1
+            # Forgets the names that are too far behind
+            while window and window[0][0] <= token_position - self.radius:
+                window.popleft()
+            for _, other_id in window:
+                if other_id != name_id:
+                    # Unordered pair packed in a single int key
+                    low, high = min(name_id, other_id), max(name_id, other_id)
+                    self.pair_counts[low * n_names + high] += 1
+            window.append((token_position, name_id))
+        self.position += n_tokens
+
+    def totals(self) -> tuple[list[int], dict[int, int]]:
+        """Name counts by id and pair counts by packed key."""
+        return self.counts, self.pair_counts
+
+    def name_counts(self) -> dict[str, int]:
+        """Occurrences of every name."""
+        counts, _ = self.totals()
+        return dict(zip(self.names, counts))
+
+    def related_names(self) -> dict[str, dict[str, int]]:
+        """Symmetric co-occurrence counts, {name: {other name: count}}."""
+        n_names = len(self.names)
+        _, pair_counts = self.totals()
+        related_names = defaultdict(dict)
+        for key, count in pair_counts.items():
+            low, high = divmod(key, n_names)
+            related_names[self.names[low]][self.names[high]] = count
+            related_names[self.names[high]][self.names[low]] = count
+        return dict(related_names)
+
+    def edge_list(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Co-occurrences as columns, every unordered pair once with src < dst.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: src ids, dst ids
+            (uint32) and counts (int64), sorted by (src, dst).
+        """
+        n_names = len(self.names)
+        _, pair_counts = self.totals()
+        keys = np.fromiter(pair_counts.keys(), dtype=np.int64, count=len(pair_counts))
+        weights = np.fromiter(pair_counts.values(), dtype=np.int64, count=len(pair_counts))
+        order = np.argsort(keys)
+        src, dst = np.divmod(keys[order], n_names)
+        return src.astype(np.uint32), dst.astype(np.uint32), weights[order]
+
+    def merge(self, other: "CooccurrenceCounter") -> None:
+        """Adds the counts of another counter over the same names."""
+        for name_id, count in enumerate(other.counts):
+            self.counts[name_id] += count
+        for key, count in other.pair_counts.items():
+            self.pair_counts[key] += count
+
+
+@dataclass
+class TimelineCounter(CooccurrenceCounter):
+    """CooccurrenceCounter that also splits the counts into time windows.
+
+    counts and pair_counts only hold the open time window, as sparse dicts.
+    end_window stores them as the deltas of that window, adds them to the
+    totals and starts empty ones, so a boundary costs as much as the keys
+    that changed in the window. totals() are the counts of the closed windows.
+
+    Args:
+        names (list[str]): character names.
+        radius (int): window size in tokens. Defaults to FRIEND_RADIUS.
+    """
+
+    window_counts: list[dict[int, int]] = field(init=False, default_factory=list)
+    window_pairs: list[dict[int, int]] = field(init=False, default_factory=list)
+    total_counts: list[int] = field(init=False)
+    total_pairs: dict[int, int] = field(init=False, default_factory=lambda: defaultdict(int))
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        self.total_counts = [0] * len(self.names)
+        self.counts = defaultdict(int)
+
+    def totals(self) -> tuple[list[int], dict[int, int]]:
+        return self.total_counts, self.total_pairs
+
+    def end_window(self) -> None:
+        """Closes the current time window, empty windows are kept too."""
+        for name_id, count in self.counts.items():
+            self.total_counts[name_id] += count
+        for key, count in self.pair_counts.items():
+            self.total_pairs[key] += count
+        self.window_counts.append(dict(self.counts))
+        self.window_pairs.append(dict(self.pair_counts))
+        self.counts = defaultdict(int)
+        self.pair_counts = defaultdict(int)
+
+    def window_name_counts(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Name count deltas of all the windows as columns.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: window offsets (like in
+            window_edge_list), name ids (uint32) and count deltas.
+        """
+        window_ptr = np.zeros(len(self.window_counts) + 1, dtype=np.int64)
+        window_ptr[1:] = np.cumsum([len(counts) for counts in self.window_counts])
+        name_ids = np.fromiter(
+            (name_id for counts in self.window_counts for name_id in sorted(counts)),
+            dtype=np.uint32, count=window_ptr[-1],
+        )
+        counts = np.fromiter(
+            (counts[name_id] for counts in self.window_counts for name_id in sorted(counts)),
+            dtype=np.int64, count=window_ptr[-1],
+        )
+        return window_ptr, name_ids, counts
+
+    def window_edge_list(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Pair deltas of all the windows as columns.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: window
+            offsets (the deltas of window w are entries window_ptr[w] to
+            window_ptr[w + 1]), src ids, dst ids and count deltas.
+        """
+        n_names = len(self.names)
+        window_ptr = np.zeros(len(self.window_pairs) + 1, dtype=np.int64)
+        window_ptr[1:] = np.cumsum([len(pairs) for pairs in self.window_pairs])
+        keys = np.zeros(window_ptr[-1], dtype=np.int64)
+        weights = np.zeros(window_ptr[-1], dtype=np.int64)
+        for window, pairs in enumerate(self.window_pairs):
+            start, end = window_ptr[window], window_ptr[window + 1]
+            window_keys = np.fromiter(pairs.keys(), dtype=np.int64, count=len(pairs))
+            order = np.argsort(window_keys)
+            keys[start:end] = window_keys[order]
+            weights[start:end] = np.fromiter(pairs.values(), dtype=np.int64, count=len(pairs))[order]
+        src, dst = np.divmod(keys, n_names)
+        return window_ptr, src.astype(np.uint32), dst.astype(np.uint32), weights
+
+
+def count_lines(lines, counter: CooccurrenceCounter, scanner: NameScanner, verbose: bool = False) -> CooccurrenceCounter:
+    """Feeds lines of text to a counter.
+
+    Args:
+        lines (Iterable[str]): lines of text.
+        counter (CooccurrenceCounter): counter to update.
+        scanner (NameScanner): name scanner.
+        verbose (bool): prints every match. Defaults to False.
+
+    Returns:
+        CooccurrenceCounter: the updated counter.
+    """
+    for line in lines:
+        tokens = scanner.tokenize(line)
+        matches = scanner.scan(tokens)
+
+        if verbose:
+            for name_index, name in matches:
+                print(f"{name=}")
                 print(f"{name_index=}")
-                # Creo que no tiene caso crear relaciones entre personajes que esten en oraciones distintas,
-                # pues que puede ser que este ocurriendo algo diferente. No siempre será el caso, pero de
-                # momento así lo dejaré
-                end_line_search = min(name_index + FRIEND_RADIUS, len(line))  # Checa que no se nos acabe la linea
-                # print(f"{end_line_search=}")
-                # Looks for new related names
-                for word in line[name_index+1:end_line_search]:
-                    # print(f"{word=}")
-                    if word in CHARACTERS and word != name:
-                        related_names[name][word] += 1
-
-                # print(f"{line[name_index]=}")
-                # print(f"name index: {line.index(name)}")
-                # print(f"Match: {name}")
-            
-
-                # Find the words within the next 15 words
-            #     try:
-            #         index = [w.capitalize() for w in line_buffer].index(name)
-            #     except ValueError:
-            #         continue
-            #     end_index = min(index + 100, len(line_buffer))
-            #     next_words = line_buffer[index+1:end_index]
-            
-            #     for word in next_words:
-            #         # print(f"Checking for related names to {name}...")
-            #         # Check if the word is another name from the list
-            #         word = word.capitalize()
-            #         if word in CHARACTERS and word != name:
-            #             # print(f"Found related name: {word}")
-            #             # Increment the count for the related name
-            #             related_names[name][word] += 1
-
-            #     # Remove processed words from the buffer
-            # line_buffer = line_buffer[end_index:]
-        
-    with open('name_counts_example.json', 'w') as name_counts_file:
-        json.dump(name_counts, name_counts_file)
-
-    with open('related_names_example.json', 'w') as related_names_file:
-        json.dump(related_names, related_names_file)
-
-    # with open("name_counts.json", "w") as name_counts_file:
-    #     json.dump(name_counts, name_counts_file)
+
+        # Update counters
+        counter.add(len(tokens), matches)
+
+    return counter
+
+
+def count_timeline(
+    lines,
+    counter: TimelineCounter,
+    scanner: NameScanner,
+    lines_per_window: int = None,
+    chapter_pattern: str = None,
+) -> TimelineCounter:
+    """Feeds lines of text to a counter, closing a time window at every boundary.
+
+    A window ends every lines_per_window lines, or before every line that
+    matches chapter_pattern (the text before the first chapter is window 0),
+    and at the end of the lines. The token window still crosses the
+    boundaries, a co-occurrence belongs to the time window of its second name.
+
+    Args:
+        lines (Iterable[str]): lines of text.
+        counter (TimelineCounter): counter to update.
+        scanner (NameScanner): name scanner.
+        lines_per_window (int): lines per time window. Defaults to None.
+        chapter_pattern (str): regular expression of the chapter lines. Defaults to None.
+
+    Returns:
+        TimelineCounter: the updated counter.
+    """
+    chapter = re.compile(chapter_pattern) if chapter_pattern is not None else None
+    for line_number, line in enumerate(lines):
+        if chapter is not None and chapter.match(line):
+            counter.end_window()
+        elif lines_per_window is not None and line_number > 0 and line_number % lines_per_window == 0:
+            counter.end_window()
+        tokens = scanner.tokenize(line)
+        counter.add(len(tokens), scanner.scan(tokens))
+    counter.end_window()
+
+    return counter
+
+
+def count_mapped(
+    path: str,
+    counter: CooccurrenceCounter,
+    start: int = 0,
+    end: int = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> CooccurrenceCounter:
+    """Feeds a byte range of a file to a counter through a memory map.
+
+    The file is scanned in chunks of about chunk_size bytes, every chunk is
+    decoded and tokenized like count_lines does, so both readers give the
+    same counts. Chunks end after a line break (or a space for very long
+    lines) so no token is split between chunks. Used by the corpus mode,
+    which needs byte ranges. For a single book it is not faster than
+    count_lines.
+
+    Args:
+        path (str): text file (UTF-8).
+        counter (CooccurrenceCounter): counter to update.
+        start (int): first byte. Defaults to 0.
+        end (int): byte after the last one, end of file if None. Defaults to None.
+        chunk_size (int): approximate bytes per chunk. Defaults to CHUNK_SIZE.
+
+    Returns:
+        CooccurrenceCounter: the updated counter.
+    """
+    if os.path.getsize(path) == 0:
+        return counter
+
+    scanner = NameScanner(counter.names)
+    with open(path, 'rb') as book_file, mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ) as book:
+        end = len(book) if end is None else end
+        while start < end:
+            chunk_end = min(start + chunk_size, end)
+            if chunk_end < end:
+                # Cuts after the last line break, or else after the last space
+                cut = book.rfind(b"\n", start, chunk_end)
+                if cut < 0:
+                    cut = book.rfind(b" ", start, chunk_end)
+                if cut < 0:
+                    # No whitespace at all, at least not in the middle of a character
+                    cut = chunk_end - 1
+                    while cut > start and 0x80 <= book[cut + 1] < 0xc0:
+                        cut -= 1
+                chunk_end = cut + 1
+            tokens = scanner.tokenize(book[start:chunk_end].decode('utf-8'))
+            counter.add(len(tokens), scanner.scan(tokens))
+            start = chunk_end
+
+    return counter
+
+
+def save_edge_list(directory: str, counter: CooccurrenceCounter) -> None:
+    """Writes the counts in the binary edge list format.
+
+    The directory holds one .npy file per column, src.npy, dst.npy and
+    weight.npy for the edges and counts.npy for the names, plus names.txt
+    with one name per line (row i is name id i). Every column can be memory
+    mapped with np.load(..., mmap_mode='r'), see book_novel_graph.load_edge_list.
+
+    Args:
+        directory (str): output directory, created if missing.
+        counter (CooccurrenceCounter): counts to write.
+    """
+    os.makedirs(directory, exist_ok=True)
+    src, dst, weight = counter.edge_list()
+    np.save(os.path.join(directory, "src.npy"), src)
+    np.save(os.path.join(directory, "dst.npy"), dst)
+    np.save(os.path.join(directory, "weight.npy"), weight)
+    counts, _ = counter.totals()
+    np.save(os.path.join(directory, "counts.npy"), np.asarray(counts, dtype=np.int64))
+    with open(os.path.join(directory, "names.txt"), 'w', encoding='utf-8') as names_file:
+        names_file.write("\n".join(counter.names) + "\n")
+
+
+def save_timeline(directory: str, counter: TimelineCounter) -> None:
+    """Writes the total counts and the time windows in the binary edge list format.
+
+    Besides the files of save_edge_list the directory holds window_ptr.npy,
+    window_src.npy, window_dst.npy and window_weight.npy with the pair deltas
+    of every window (see TimelineCounter.window_edge_list), and
+    window_count_ptr.npy, window_name.npy and window_count.npy with the name
+    count deltas (see TimelineCounter.window_name_counts).
+
+    Args:
+        directory (str): output directory, created if missing.
+        counter (TimelineCounter): counts to write.
+    """
+    save_edge_list(directory, counter)
+    window_ptr, src, dst, weight = counter.window_edge_list()
+    np.save(os.path.join(directory, "window_ptr.npy"), window_ptr)
+    np.save(os.path.join(directory, "window_src.npy"), src)
+    np.save(os.path.join(directory, "window_dst.npy"), dst)
+    np.save(os.path.join(directory, "window_weight.npy"), weight)
+    count_ptr, name_ids, counts = counter.window_name_counts()
+    np.save(os.path.join(directory, "window_count_ptr.npy"), count_ptr)
+    np.save(os.path.join(directory, "window_name.npy"), name_ids)
+    np.save(os.path.join(directory, "window_count.npy"), counts)
+
+
+def shard_file(path: str, shard_size: int = SHARD_SIZE) -> list[tuple[str, int, int]]:
+    """Splits a file into byte ranges that start and end at line boundaries.
+
+    Args:
+        path (str): text file.
+        shard_size (int): approximate bytes per shard. Defaults to SHARD_SIZE.
+
+    Returns:
+        list[tuple[str, int, int]]: (path, start, end) of every shard.
+    """
+    file_size = os.path.getsize(path)
+    shards = []
+    start = 0
+    with open(path, 'rb') as book_file:
+        while start < file_size:
+            book_file.seek(min(start + shard_size, file_size))
+            # Moves the end to the next line break
+            book_file.readline()
+            end = min(book_file.tell(), file_size)
+            shards.append((path, start, end))
+            start = end
+    return shards
+
+
+def count_shard(shard: tuple[str, int, int], radius: int = FRIEND_RADIUS) -> CooccurrenceCounter:
+    """Counts names and co-occurrences of a byte range of a file.
+
+    Args:
+        shard (tuple[str, int, int]): (path, start, end), e.g. from shard_file.
+        radius (int): co-occurrence window in tokens. Defaults to FRIEND_RADIUS.
+
+    Returns:
+        CooccurrenceCounter: counts of the shard.
+    """
+    path, start, end = shard
+    counter = CooccurrenceCounter(CHARACTERS, radius=radius)
+    return count_mapped(path, counter, start=start, end=end)
+
+
+def count_corpus(paths: list[str], n_processes: int = None, shard_size: int = SHARD_SIZE) -> CooccurrenceCounter:
+    """Counts a corpus of books in a process pool.
+
+    Files are split into line aligned shards, every shard is counted in a
+    worker and the counters are merged. Windows do not cross shard
+    boundaries, so a few co-occurrences at the shard edges are lost.
+
+    Args:
+        paths (list[str]): text files.
+        n_processes (int): pool size, all cores if None. Defaults to None.
+        shard_size (int): approximate bytes per shard. Defaults to SHARD_SIZE.
+
+    Returns:
+        CooccurrenceCounter: merged counts.
+    """
+    shards = [shard for path in paths for shard in shard_file(path, shard_size)]
+    counter = CooccurrenceCounter(CHARACTERS)
+    with Pool(processes=n_processes) as pool:
+        for shard_counter in pool.imap_unordered(count_shard, shards):
+            counter.merge(shard_counter)
+    return counter
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Reads and process command line arguments.
+
+    Returns:
+        argparse.Namespace: books, pool size, shard size, verbosity,
+        time windows, output files and output format.
+    """
+    parser = argparse.ArgumentParser(
+        description="Counts character names and their co-occurrences in books."
+    )
+    parser.add_argument(
+        "books",
+        nargs="*",
+        default=["./Graphs/example_text.txt"],
+        help="Text files. Default is ./Graphs/example_text.txt",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Worker processes, more than 1 enables the corpus mode. Default is 1.",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=SHARD_SIZE,
+        help=f"Bytes per shard in corpus mode. Default is {SHARD_SIZE}.",
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="Memory maps the books instead of reading them line by line (UTF-8 only).",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Prints every match (single process, without --mmap).",
+    )
+    parser.add_argument(
+        "--name-counts",
+        default="name_counts_example.json",
+        help="Output file of the name counts. Default is name_counts_example.json",
+    )
+    parser.add_argument(
+        "--related-names",
+        default="related_names_example.json",
+        help="Output file of the co-occurrences. Default is related_names_example.json",
+    )
+    parser.add_argument(
+        "--edge-list",
+        default=EDGE_LIST,
+        help=f"Output directory of the binary edge list. Default is {EDGE_LIST}",
+    )
+    parser.add_argument(
+        "--lines-per-window",
+        type=int,
+        default=None,
+        help="Also writes the counts of every time window of this many lines to the edge list directory.",
+    )
+    parser.add_argument(
+        "--chapters",
+        action="store_true",
+        help="Also writes the counts of every chapter to the edge list directory.",
+    )
+    parser.add_argument(
+        "--chapter-pattern",
+        default=CHAPTER_PATTERN,
+        help=f"Regular expression of the lines that start a chapter. Default is {CHAPTER_PATTERN!r}.",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=["json", "binary", "both"],
+        default="both",
+        help="Writes the JSON files, the binary edge list or both. Default is both.",
+    )
+
+    args = parser.parse_args()
+    if (args.lines_per_window is not None or args.chapters) and args.output_format == "json":
+        parser.error("time windows are only written to the binary edge list, use --output-format binary or both")
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    timeline = args.lines_per_window is not None or args.chapters
+
+    if timeline:
+        # Single pass in text mode, lines are needed for the window boundaries
+        scanner = NameScanner(CHARACTERS)
+        counter = TimelineCounter(CHARACTERS)
+        for book in args.books:
+            counter.window.clear()
+            with open(book, 'r', encoding='utf-8') as book_file:
+                count_timeline(
+                    book_file,
+                    counter,
+                    scanner,
+                    lines_per_window=args.lines_per_window,
+                    chapter_pattern=args.chapter_pattern if args.chapters else None,
+                )
+    elif args.processes > 1:
+        counter = count_corpus(args.books, n_processes=args.processes, shard_size=args.shard_size)
+    else:
+        # Tokenizes each line once and looks the names up in a hash table
+        scanner = NameScanner(CHARACTERS)
+        # Co-occurrences within FRIEND_RADIUS tokens, across lines
+        counter = CooccurrenceCounter(CHARACTERS)
+        for book in args.books:
+            # Windows do not cross books
+            counter.window.clear()
+            if args.mmap and not args.verbose:
+                count_mapped(book, counter)
+            else:
+                # Read txt book file
+                with open(book, 'r', encoding='utf-8') as book_file:
+                    count_lines(book_file, counter, scanner, verbose=args.verbose)
+
+    if args.output_format in ("binary", "both"):
+        if timeline:
+            save_timeline(args.edge_list, counter)
+        else:
+            save_edge_list(args.edge_list, counter)
+
+    if args.output_format in ("json", "both"):
+        name_counts = counter.name_counts()
+        related_names = counter.related_names()
+
+        with open(args.name_counts, 'w') as name_counts_file:
+            json.dump(name_counts, name_counts_file)
+
+        with open(args.related_names, 'w') as related_names_file:
+            json.dump(related_names, related_names_file)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -14,11 +14,13 @@ Description:
 
 
 # SECTION - LIBRARIES
+from dataclasses import dataclass, field
+from decimal import Decimal, localcontext
 import numpy as np
 from matplotlib import rc  # Enable Latex Figures
 import matplotlib.pyplot as plt
 import seaborn as sns
-from typing import Callable
+from typing import Callable, Iterator, Union
 
 # !SECTION
 # SECTION - MATPLOTLIB LATEX CONFIG
@@ -43,9 +45,82 @@ def logistic_map_eq(r: float, x_current: float) -> float:
     x_next = r * x_current * (1 - x_current)
     return x_next
 
+def logistic_map_composition(r: np.ndarray, x_current: np.ndarray, n: int = 1, grid: bool = False) -> np.ndarray:
+    """n-fold composition f^n(x) of the logistic map with array arithmetic.
+
+    Args:
+        r (np.ndarray): growth factors.
+        x_current (np.ndarray): population sizes, broadcastable with r.
+        n (int): number of compositions, f^1 is logistic_map_eq. Defaults to 1.
+        grid (bool): evaluate over the (r, x) grid, i.e. r as rows and
+            x_current as columns. Defaults to False.
+
+    Returns:
+        x_next (np.ndarray): f^n(x) values, shape (len(r), len(x_current)) if grid.
+    """
+    r = np.asarray(r, dtype=np.float64)
+    x_next = np.asarray(x_current, dtype=np.float64)
+    if grid:
+        r, x_next = np.meshgrid(r, x_next, indexing="ij")
+
+    for _ in range(n):
+        x_next = logistic_map_eq(r=r, x_current=x_next)
+
+    return x_next
+
+def iterate_map(func: Callable, x_current: float, n_iterations: int, skip: int = 0, stride: int = 1, **args) -> Iterator[float]:
+    """Iterates a map f(x) and yields its orbit one value at a time.
+
+    Yields x_skip, x_{skip + stride}, ... up to x_{n_iterations}, so only the
+    current value is kept in memory.
+
+    Args:
+        func (Callable): function f(x), e.g. logistic_map_eq.
+        x_current (float): initial value x_0.
+        n_iterations (int): number of applications of f.
+        skip (int): number of initial values not yielded (transient). Defaults to 0.
+        stride (int): yield one of every `stride` values. Defaults to 1.
+
+    Yields:
+        x_n (float): orbit values.
+    """
+    for n in range(n_iterations + 1):
+        if n >= skip and (n - skip) % stride == 0:
+            yield x_current
+        if n < n_iterations:
+            x_current = func(x_current=x_current, **args)
+
+def orbit(func: Callable, x_current: float, n_iterations: int, skip: int = 0, stride: int = 1, out: np.ndarray = None, **args) -> np.ndarray:
+    """Stores the orbit of a map f(x) in a preallocated array.
+
+    Args:
+        func (Callable): function f(x), e.g. logistic_map_eq.
+        x_current (float): initial value x_0.
+        n_iterations (int): number of applications of f.
+        skip (int): number of initial values not stored (transient). Defaults to 0.
+        stride (int): store one of every `stride` values. Defaults to 1.
+        out (np.ndarray): array to fill, allocated if None. Defaults to None.
+
+    Returns:
+        out (np.ndarray): orbit values x_skip, x_{skip + stride}, ...
+    """
+    n_values = len(range(skip, n_iterations + 1, stride))
+    if out is None:
+        out = np.empty(shape=n_values, dtype=np.float64)
+    elif len(out) < n_values:
+        raise ValueError(f"out has {len(out)} elements but the orbit has {n_values} values")
+
+    for n, x_n in enumerate(iterate_map(func, x_current, n_iterations, skip=skip, stride=stride, **args)):
+        out[n] = x_n
+
+    return out
+
 def recursive_function(func: Callable, n_iterations: int, x_current: float, x_n_list: list[float], **args):
     """Makes recursion calls to a function f(x) that depends on its previous n values.
 
+    Kept for compatibility, it iterates with iterate_map so long orbits do
+    not hit the recursion limit.
+
     Args:
         func (Callable): function f(x). 
         n_iterations (int): number of recursive calls.
@@ -55,13 +130,250 @@ def recursive_function(func: Callable, n_iterations: int, x_current: float, x_n_
     Returns:
         x_n_list (list[float]): list of obtained values. 
     """
-    if n_iterations < 1:
-        x_n_list.append(x_current)
-        return x_n_list
-    else:
-        x_n_list.append(x_current)
-        x_next = func(x_current=x_current, **args)
-        return recursive_function(func=func, n_iterations=n_iterations-1, x_current=x_next, x_n_list=x_n_list, **args)
+    x_n_list.extend(iterate_map(func, x_current, n_iterations, **args))
+    return x_n_list
+
+def bifurcation_samples(r_values: np.ndarray, x_current: float = 0.5, n_transient: int = 100, n_samples: int = 100, dtype: np.dtype = np.float64) -> np.ndarray:
+    """Iterates the logistic map for every growth rate at once.
+
+    The first `n_transient` iterations are discarded and the next `n_samples`
+    values are stored as the attractor of each r.
+
+    Args:
+        r_values (np.ndarray): growth factors.
+        x_current (float): initial population size shared by every r. Defaults to 0.5.
+        n_transient (int): number of discarded iterations. Defaults to 100.
+        n_samples (int): number of stored iterations. Defaults to 100.
+        dtype (np.dtype): float type of the iteration, np.float32 runs twice the
+            lanes per vector instruction. Defaults to np.float64.
+
+    Returns:
+        samples (np.ndarray): (len(r_values), n_samples) array of population sizes.
+    """
+    r_values = np.asarray(r_values, dtype=dtype)
+    x_current = np.full_like(r_values, x_current)
+    samples = np.empty(shape=(r_values.size, n_samples), dtype=dtype)
+
+    for _ in range(n_transient):
+        x_current = logistic_map_eq(r=r_values, x_current=x_current)
+
+    for n in range(n_samples):
+        samples[:, n] = x_current
+        x_current = logistic_map_eq(r=r_values, x_current=x_current)
+
+    return samples
+
+def logistic_orbits(r_values: np.ndarray, x_current: float = 0.5, n_iterations: int = 100, dtype: Union[np.dtype, str] = np.float64, precision: int = 100) -> np.ndarray:
+    """Orbits x_0, ..., x_{n_iterations} of every r in a given precision.
+
+    Args:
+        r_values (np.ndarray): growth factors.
+        x_current (float): initial population size shared by every r. Defaults to 0.5.
+        n_iterations (int): number of iterations. Defaults to 100.
+        dtype (np.dtype | str): np.float32, np.float64 or "decimal" for
+            arbitrary precision (object arrays of Decimal). Defaults to np.float64.
+        precision (int): significant digits of the "decimal" mode. Defaults to 100.
+
+    Returns:
+        orbits (np.ndarray): (len(r_values), n_iterations + 1) array, object
+        dtype in "decimal" mode.
+    """
+    if dtype != "decimal":
+        return bifurcation_samples(r_values, x_current=x_current, n_transient=0, n_samples=n_iterations + 1, dtype=dtype)
+
+    with localcontext() as context:
+        context.prec = precision
+        # Exact binary values of the inputs, so only the arithmetic differs
+        r_values = np.array([Decimal(float(r)) for r in np.ravel(r_values)], dtype=object)
+        x_values = np.full(r_values.shape, Decimal(float(x_current)), dtype=object)
+        orbits = np.empty(shape=(r_values.size, n_iterations + 1), dtype=object)
+        for n in range(n_iterations + 1):
+            orbits[:, n] = x_values
+            x_values = logistic_map_eq(r=r_values, x_current=x_values)
+
+    return orbits
+
+def precision_divergence(r_values: np.ndarray, x_current: float = 0.5, n_iterations: int = 100, dtypes: tuple = (np.float32, np.float64), precision: int = 100, threshold: float = 1e-3) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """Compares orbits computed in different precisions against a Decimal reference.
+
+    Args:
+        r_values (np.ndarray): growth factors.
+        x_current (float): initial population size shared by every r. Defaults to 0.5.
+        n_iterations (int): number of iterations. Defaults to 100.
+        dtypes (tuple): precisions to check. Defaults to (np.float32, np.float64).
+        precision (int): significant digits of the reference. Defaults to 100.
+        threshold (float): error above which an orbit value is no longer
+            trusted. Defaults to 1e-3.
+
+    Returns:
+        dict[str, tuple[np.ndarray, np.ndarray]]: for every dtype name, the
+        (len(r_values), n_iterations + 1) absolute error and the number of
+        trustworthy iterations of each r.
+    """
+    reference = logistic_orbits(r_values, x_current, n_iterations, dtype="decimal", precision=precision).astype(np.float64)
+
+    divergence = {}
+    for dtype in dtypes:
+        orbits = logistic_orbits(r_values, x_current, n_iterations, dtype=dtype)
+        error = np.abs(orbits.astype(np.float64) - reference)
+        diverged = error > threshold
+        # First diverging iteration, or all of them if it never diverges
+        trusted_steps = np.where(diverged.any(axis=1), diverged.argmax(axis=1), n_iterations + 1)
+        divergence[np.dtype(dtype).name] = (error, trusted_steps)
+
+    return divergence
+
+def logistic_sweep(r_values: np.ndarray, x_current: float = 0.5, n_transient: int = 100, n_samples: int = 100, max_period: int = 64, tol: float = 1e-9, period_tol: float = 1e-6) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Bifurcation samples, Lyapunov exponent and attractor period in one pass.
+
+    Every r is iterated at the same time. Growth rates whose orbit has
+    converged to a fixed point (|x_{n+1} - x_n| < tol) stop being iterated and
+    the rest of their samples are filled with the fixed point.
+
+    The Lyapunov exponent is the mean of log|r (1 - 2 x_n)| over the samples
+    and the period is the smallest p <= max_period with x_{n+p} = x_n (within
+    period_tol) along the last 2 * max_period samples, 0 if none is found
+    (e.g. chaos).
+
+    Args:
+        r_values (np.ndarray): growth factors.
+        x_current (float): initial population size shared by every r. Defaults to 0.5.
+        n_transient (int): number of discarded iterations. Defaults to 100.
+        n_samples (int): number of stored iterations. Defaults to 100.
+        max_period (int): largest period looked for. Defaults to 64.
+        tol (float): fixed point convergence tolerance. Defaults to 1e-9.
+        period_tol (float): tolerance when comparing orbit values. Defaults to 1e-6.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (len(r_values), n_samples)
+        samples, Lyapunov exponents and periods for every r.
+    """
+    r_values = np.asarray(r_values, dtype=np.float64)
+    x_values = np.full_like(r_values, x_current)
+    samples = np.empty(shape=(r_values.size, n_samples), dtype=np.float64)
+    log_sum = np.zeros_like(r_values)
+    active = np.arange(r_values.size)  # Indices of r values still iterated
+
+    def log_derivative(index):
+        return np.log(np.abs(r_values[index] * (1 - 2 * x_values[index])))
+
+    with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+        for _ in range(n_transient):
+            x_next = logistic_map_eq(r=r_values[active], x_current=x_values[active])
+            converged = np.abs(x_next - x_values[active]) < tol
+            x_values[active] = x_next
+            active = active[~converged]
+
+        # Fixed points reached during the transient
+        frozen = np.ones(r_values.size, dtype=bool)
+        frozen[active] = False
+        samples[frozen] = x_values[frozen, None]
+        log_sum[frozen] = n_samples * log_derivative(frozen)
+
+        for n in range(n_samples):
+            samples[active, n] = x_values[active]
+            log_sum[active] += log_derivative(active)
+            x_next = logistic_map_eq(r=r_values[active], x_current=x_values[active])
+            converged = np.abs(x_next - x_values[active]) < tol
+            x_values[active] = x_next
+            # Remaining samples of newly converged r values are the fixed point
+            done = active[converged]
+            samples[done, n + 1:] = x_values[done, None]
+            log_sum[done] += (n_samples - n - 1) * log_derivative(done)
+            active = active[~converged]
+
+        lyapunov = log_sum / n_samples
+
+        # Periods are looked for in the last 2 * max_period samples only
+        tail = samples[:, -min(n_samples, 2 * max_period):]
+        period = np.zeros(r_values.size, dtype=np.int64)
+        undecided = np.arange(r_values.size)
+        for p in range(1, min(max_period, tail.shape[1] - 1) + 1):
+            repeats = np.all(np.abs(tail[undecided, p:] - tail[undecided, :-p]) < period_tol, axis=1)
+            period[undecided[repeats]] = p
+            undecided = undecided[~repeats]
+
+    return samples, lyapunov, period
+
+@dataclass
+class DensityRaster:
+    """Class for accumulating bifurcation samples into a 2D histogram.
+
+    Args:
+        r_range (tuple[float, float]): limits of the growth factor axis.
+        x_range (tuple[float, float]): limits of the population axis.
+        shape (tuple[int, int]): (x bins, r bins) of the image. Defaults to 4k (2160, 3840).
+    """
+
+    r_range: tuple[float, float]
+    x_range: tuple[float, float] = (0, 1)
+    shape: tuple[int, int] = (2160, 3840)
+    counts: np.ndarray = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.counts = np.zeros(shape=self.shape, dtype=np.uint64)
+
+    def add(self, r_values: np.ndarray, x_values: np.ndarray) -> None:
+        """Adds samples to the histogram, samples out of range are ignored.
+
+        Args:
+            r_values (np.ndarray): growth factors, broadcastable to x_values.
+            x_values (np.ndarray): population sizes.
+        """
+        r_values, x_values = np.broadcast_arrays(r_values, x_values)
+        n_x, n_r = self.shape
+        col = np.floor((r_values.ravel() - self.r_range[0]) / (self.r_range[1] - self.r_range[0]) * n_r)
+        row = np.floor((x_values.ravel() - self.x_range[0]) / (self.x_range[1] - self.x_range[0]) * n_x)
+        # The upper limit belongs to the last bin
+        col[col == n_r] = n_r - 1
+        row[row == n_x] = n_x - 1
+        inside = (col >= 0) & (col < n_r) & (row >= 0) & (row < n_x)
+        flat_index = row[inside].astype(np.int64) * n_r + col[inside].astype(np.int64)
+        np.add.at(self.counts.reshape(-1), flat_index, 1)
+
+    def to_image(self) -> np.ndarray:
+        """Log-scaled histogram normalized to [0, 1]."""
+        image = np.log1p(self.counts.astype(np.float64))
+        if image.max() > 0:
+            image /= image.max()
+        return image
+
+    def save(self, file_name: str, cmap: str = "binary") -> None:
+        """Writes the log-scaled histogram straight to an image file.
+
+        Args:
+            file_name (str): output image, e.g. "bifurcation_plot.png".
+            cmap (str): matplotlib colormap. Defaults to "binary".
+        """
+        plt.imsave(file_name, self.to_image(), cmap=cmap, origin="lower")
+
+def bifurcation_raster(raster: DensityRaster, r_values: np.ndarray, x_current: float = 0.5, n_transient: int = 100, n_samples: int = 100) -> DensityRaster:
+    """Streams logistic map samples of every r into a DensityRaster.
+
+    Same iteration as bifurcation_samples, but each iteration is added to the
+    histogram as it is produced, so memory does not grow with n_samples.
+
+    Args:
+        raster (DensityRaster): histogram to fill.
+        r_values (np.ndarray): growth factors.
+        x_current (float): initial population size shared by every r. Defaults to 0.5.
+        n_transient (int): number of discarded iterations. Defaults to 100.
+        n_samples (int): number of accumulated iterations. Defaults to 100.
+
+    Returns:
+        raster (DensityRaster): the filled histogram.
+    """
+    r_values = np.asarray(r_values, dtype=np.float64)
+    x_current = np.full_like(r_values, x_current)
+
+    for _ in range(n_transient):
+        x_current = logistic_map_eq(r=r_values, x_current=x_current)
+
+    for _ in range(n_samples):
+        raster.add(r_values, x_current)
+        x_current = logistic_map_eq(r=r_values, x_current=x_current)
+
+    return raster
 
 # !SECTION
 
@@ -76,9 +388,6 @@ if __name__ == "__main__":
         start=0, stop=1, num=100
     )  # Current population init values in percentage
 
-    # Function vectorization with numpy
-    vlogistic_map_eq = np.vectorize(logistic_map_eq)
-
     # !SECTION
 
     # SECTION - 2D & 3D PLOT
@@ -88,11 +397,13 @@ if __name__ == "__main__":
     ax_0 = fig.add_subplot(1, 2, 1)
     ax_1 = fig.add_subplot(1, 2, 2, projection="3d")
 
+    # x_{n+1} and x_{n+2} for every (r, x_n) pair of the grid
+    x_next_grid = logistic_map_composition(r=r_list, x_current=x_current_list, n=1, grid=True)
+    x_next_2_grid = logistic_map_composition(r=r_list, x_current=x_current_list, n=2, grid=True)
+
     for idx, r in enumerate(r_list):
-        x_next_list = vlogistic_map_eq(
-            r=r, x_current=x_current_list
-        )  # Next population value in percentage x_{n+1}
-        x_next_2_list = vlogistic_map_eq(r=r, x_current=x_next_list)  # x_{n+2}
+        x_next_list = x_next_grid[idx]  # Next population value in percentage x_{n+1}
+        x_next_2_list = x_next_2_grid[idx]  # x_{n+2}
         # 2D Plot
         sns.lineplot(ax=ax_0, x=x_current_list, y=x_next_list, label=f"{r=}")
         # 3D Plot
@@ -121,11 +432,10 @@ if __name__ == "__main__":
     n_iterations = 10
 
     # Update population value n times
-    x_n_list = recursive_function(
+    x_n_list = orbit(
         func=logistic_map_eq,
-        n_iterations=n_iterations,
         x_current=x_current,
-        x_n_list=[],
+        n_iterations=n_iterations,
         r=r
     )
 
@@ -155,11 +465,10 @@ if __name__ == "__main__":
             x_current = 0.5
             r = r_list[id_row * axs.shape[1] + id_col]  # Obtains growth rate
 
-            x_n_list = recursive_function(
+            x_n_list = orbit(
                 func=logistic_map_eq,
-                n_iterations=n_iterations,
                 x_current=x_current,
-                x_n_list=[],
+                n_iterations=n_iterations,
                 r=r
             )
 
@@ -194,30 +503,36 @@ if __name__ == "__main__":
 
     fig = plt.figure(figsize=(10,10))
 
-    for r in r_list:
-        x_current = 0.5
-
-        x_current = recursive_function(
-            func=logistic_map_eq,
-            n_iterations=n_iterations,
-            x_current=x_current,
-            x_n_list=[],
-            r=r
-        )[-1]  # Selects last value obtained
-
-        x_n_list = recursive_function(
-            func=logistic_map_eq,
-            n_iterations=n_iterations,
-            x_current=x_current,
-            x_n_list=[],
-            r=r
-        )
-        plt.scatter([r for _ in range(len(x_n_list))], x_n_list, c="black", marker=',', s=1)  # Plot points
+    # Every r is iterated at the same time, x_100 to x_200 are kept
+    x_n_array = bifurcation_samples(r_values=r_list, n_transient=n_iterations, n_samples=n_iterations + 1)
+    plt.scatter(np.repeat(r_list, x_n_array.shape[1]), x_n_array.ravel(), c="black", marker=',', s=1)  # Plot points
 
     plt.title("Bifurcation plot")
     plt.xlabel("$r$")
     plt.ylabel("$x$")
     plt.savefig("bifurcation_plot.png", dpi=300)
 
+    # High resolution version rendered as a log-scaled density image
+    raster = DensityRaster(r_range=(1, 4))
+    bifurcation_raster(raster, r_values=np.linspace(start=1, stop=4, num=raster.shape[1] * 4), n_transient=n_iterations, n_samples=1000)
+    raster.save("bifurcation_density.png")
+
+    # !SECTION
+
+    # SECTION - LYAPUNOV EXPONENT & PERIOD
+    # The same sweep also gives the Lyapunov exponent (chaos when > 0) and the period of the attractor
+    r_list = np.linspace(start=1, stop=4, num=10000)
+    _, lyapunov, period = logistic_sweep(r_values=r_list, n_transient=1000, n_samples=1000)
+
+    fig, axs = plt.subplots(nrows=2, ncols=1, figsize=(10, 10), sharex=True, layout="tight")
+    axs[0].plot(r_list, lyapunov, c="black", lw=0.5)
+    axs[0].axhline(0, c="r", lw=0.5)
+    axs[0].set_ylabel("$\\lambda$")
+    axs[1].scatter(r_list, period, c="black", marker=',', s=1)
+    axs[1].set_xlabel("$r$")
+    axs[1].set_ylabel("Period")
+    plt.suptitle("Lyapunov exponent and period")
+    plt.savefig("lyapunov_period_plot.png", dpi=300)
+
     # !SECTION
 # !SECTION
\ No newline at end of file
@@ -18,7 +18,10 @@ Description:
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import rc
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
 from scipy.integrate import solve_ivp
+from time import perf_counter
+from typing import Iterator
 
 # ---------------------------------------------------------------------------- #
 #                                   CONSTANTS                                  #
@@ -29,6 +32,10 @@ SIGMA = 10  # a
 RHO = 28  # b
 BETA = 8/3  # c
 TIME_STEP = 0.01
+CHUNK_SIZE = 100000  # Steps per streamed block
+RENORM_STEPS = 10  # Steps between tangent vector renormalizations
+# Solvers that make use of the Jacobian
+IMPLICIT_METHODS = ("Radau", "BDF", "LSODA")
 
 # ---------------------------------------------------------------------------- #
 #                            MATPLOTLIB LATEX CONFIG                           #
@@ -72,17 +79,367 @@ def lorenz_system(
     return [dx_dt, dy_dt, dz_dt]
 
 
-def lorenz_solver(initial_state, sigma=SIGMA, rho=RHO, beta=BETA, dt=TIME_STEP, num_steps=NUM_STEPS):
-    # Create solver object
-    solver = solve_ivp(lorenz_system, (0, num_steps), initial_state, args=(sigma, rho, beta), dense_output=True)
+def lorenz_jacobian(
+        t: float,
+        state: np.ndarray,
+        sigma: float = SIGMA,
+        rho: float = RHO,
+        beta: float = BETA,
+    ) -> np.ndarray:
+    """Analytic Jacobian of the Lorenz system.
+
+    Args:
+        t (float): Time, unused since the system is autonomous.
+        state (np.ndarray): (x, y, z) values.
+        sigma (float, optional): Sigma parameter. Defaults to SIGMA.
+        rho (float, optional): Rho parameter. Defaults to RHO.
+        beta (float, optional): Beta parameter. Defaults to BETA.
+
+    Returns:
+        np.ndarray: (3, 3) matrix of partial derivatives.
+    """
+    x, y, z = state
+
+    return np.array([
+        [-sigma, sigma, 0.0],
+        [rho - z, -1.0, -x],
+        [y, x, -beta],
+    ])
+
+
+def _integrate_lorenz(initial_state, sigma, rho, beta, dt, num_steps, method, analytic_jacobian):
     # Define time steps array
     t = np.arange(0, num_steps * dt, dt)
+
+    # Implicit methods approximate the Jacobian by finite differences unless
+    # they get the analytic one, explicit methods never use it
+    options = {"jac": lorenz_jacobian} if analytic_jacobian and method in IMPLICIT_METHODS else {}
+
+    # Create solver object, integrating only up to the last sample
+    solver = solve_ivp(
+        lorenz_system, (0, t[-1]), initial_state, method=method,
+        args=(sigma, rho, beta), dense_output=True, **options
+    )
     # Integrate the Lorenz system
-    trajectory = solver.sol(t)
+    return solver.sol(t), solver
+
+
+def lorenz_solver(
+        initial_state,
+        sigma=SIGMA,
+        rho=RHO,
+        beta=BETA,
+        dt=TIME_STEP,
+        num_steps=NUM_STEPS,
+        method="RK45",
+        analytic_jacobian=False,
+    ):
+    """Integrates the Lorenz system and samples it every `dt`.
+
+    Args:
+        initial_state (tuple[float, float, float]): Initial (x, y, z) values.
+        sigma (float, optional): Sigma parameter. Defaults to SIGMA.
+        rho (float, optional): Rho parameter. Defaults to RHO.
+        beta (float, optional): Beta parameter. Defaults to BETA.
+        dt (float, optional): Sampling time step. Defaults to TIME_STEP.
+        num_steps (int, optional): Number of samples. Defaults to NUM_STEPS.
+        method (str, optional): `solve_ivp` method. Defaults to "RK45".
+        analytic_jacobian (bool, optional): Pass `lorenz_jacobian` to the
+            implicit methods (Radau, BDF, LSODA) instead of letting them use
+            finite differences. Defaults to False.
+
+    Returns:
+        np.ndarray: (3, num_steps) trajectory.
+    """
+    trajectory, _ = _integrate_lorenz(initial_state, sigma, rho, beta, dt, num_steps, method, analytic_jacobian)
+
+    return trajectory
+
+
+def benchmark_lorenz_solver(
+        initial_state: tuple[float, float, float] = (0.01, 0.0, 0.0),
+        methods: tuple[str, ...] = IMPLICIT_METHODS,
+        num_steps: int = NUM_STEPS,
+    ) -> dict[str, dict[str, dict[str, float]]]:
+    """Compares finite difference and analytic Jacobians over the same time span.
+
+    Args:
+        initial_state (tuple[float, float, float], optional): Initial (x, y, z)
+            values. Defaults to (0.01, 0.0, 0.0).
+        methods (tuple[str, ...], optional): `solve_ivp` methods to compare.
+            Defaults to IMPLICIT_METHODS.
+        num_steps (int, optional): Number of samples. Defaults to NUM_STEPS.
+
+    Returns:
+        dict: {method: {"finite_differences" | "analytic": {"nfev", "njev", "time"}}}.
+    """
+    results = {}
+    for method in methods:
+        results[method] = {}
+        for name, analytic_jacobian in (("finite_differences", False), ("analytic", True)):
+            start = perf_counter()
+            _, solver = _integrate_lorenz(
+                initial_state, SIGMA, RHO, BETA, TIME_STEP, num_steps, method, analytic_jacobian
+            )
+            elapsed = perf_counter() - start
+            results[method][name] = {"nfev": solver.nfev, "njev": solver.njev, "time": elapsed}
+            print(f"{method:>6} {name:>18}: nfev={solver.nfev:>8} njev={solver.njev:>6} time={elapsed:.3f} s")
+
+    return results
+
+
+def lorenz_stream(
+        initial_state: tuple[float, float, float],
+        sigma: float = SIGMA,
+        rho: float = RHO,
+        beta: float = BETA,
+        dt: float = TIME_STEP,
+        num_steps: int = NUM_STEPS,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> Iterator[np.ndarray]:
+    """Integrates the Lorenz system block by block.
+
+    Each block is solved from the last state of the previous one, so only
+    `chunk_size` steps live in memory at any time.
+
+    Args:
+        initial_state (tuple[float, float, float]): Initial (x, y, z) values.
+        sigma (float, optional): Sigma parameter. Defaults to SIGMA.
+        rho (float, optional): Rho parameter. Defaults to RHO.
+        beta (float, optional): Beta parameter. Defaults to BETA.
+        dt (float, optional): Sampling time step. Defaults to TIME_STEP.
+        num_steps (int, optional): Total number of samples. Defaults to NUM_STEPS.
+        chunk_size (int, optional): Samples per block. Defaults to CHUNK_SIZE.
+
+    Yields:
+        np.ndarray: (3, n) block of the trajectory, n <= chunk_size.
+    """
+    state = np.asarray(initial_state, dtype=np.float64)
+    for start in range(0, num_steps, chunk_size):
+        n = min(chunk_size, num_steps - start)
+        # The block includes its own starting point, hence n samples over (n - 1) * dt
+        t = start * dt + np.arange(n) * dt
+        solver = solve_ivp(
+            lorenz_system, (t[0], t[0] + n * dt), state, args=(sigma, rho, beta), dense_output=True
+        )
+        block = solver.sol(t)
+        # Next block starts one step after the last sample
+        state = solver.sol(t[0] + n * dt)
+        yield block
+
+
+def write_trajectory(
+        path: str,
+        blocks: Iterator[np.ndarray],
+        num_steps: int,
+        dtype: np.dtype = np.float32,
+    ) -> np.ndarray:
+    """Writes streamed trajectory blocks into a memory-mapped `.npy` file.
+
+    The file can be reopened later with `np.load(path, mmap_mode="r")`.
+
+    Args:
+        path (str): Output `.npy` file.
+        blocks (Iterator[np.ndarray]): (3, n) blocks, e.g. from `lorenz_stream`.
+        num_steps (int): Total number of samples the blocks add up to.
+        dtype (np.dtype, optional): Stored dtype. Defaults to np.float32.
+
+    Returns:
+        np.ndarray: (3, num_steps) memory-mapped trajectory.
+    """
+    trajectory = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(3, num_steps))
+    offset = 0
+    for block in blocks:
+        trajectory[:, offset:offset + block.shape[1]] = block
+        offset += block.shape[1]
+    trajectory.flush()
 
     return trajectory
 
 
+def trajectory_density(
+        blocks: Iterator[np.ndarray],
+        bins: tuple[int, int] = (1000, 1000),
+        plane: tuple[int, int] = (0, 2),
+        limits: tuple[tuple[float, float], tuple[float, float]] = ((-30, 30), (0, 60)),
+    ) -> np.ndarray:
+    """Accumulates a 2D density histogram of the attractor projected on a plane.
+
+    Args:
+        blocks (Iterator[np.ndarray]): (3, n) blocks, e.g. from `lorenz_stream`.
+        bins (tuple[int, int], optional): Histogram resolution. Defaults to (1000, 1000).
+        plane (tuple[int, int], optional): Coordinates to project on, 0 = x, 1 = y,
+            2 = z. Defaults to (0, 2).
+        limits (tuple, optional): Range of each projected coordinate.
+            Defaults to ((-30, 30), (0, 60)).
+
+    Returns:
+        np.ndarray: Histogram counts with shape `bins`.
+    """
+    density = np.zeros(shape=bins, dtype=np.int64)
+    for block in blocks:
+        counts, _, _ = np.histogram2d(
+            block[plane[0]], block[plane[1]], bins=bins, range=limits
+        )
+        density += counts.astype(np.int64)
+
+    return density
+
+
+def bifurcation_density(
+        rho_values: np.ndarray,
+        initial_state: tuple[float, float, float] = (0.01, 0.0, 0.0),
+        num_steps: int = 200,
+        num_samples: int = 100,
+        z_bins: int = 1000,
+        z_limits: tuple[float, float] = (0, 400),
+    ) -> np.ndarray:
+    """Accumulates a (rho, z) histogram of the last samples of every rho.
+
+    Every rho is integrated on its own and its last `num_samples` z values are
+    added to its column right away, so only one trajectory lives in memory.
+
+    Args:
+        rho_values (np.ndarray): Evenly spaced rho values, one column each.
+        initial_state (tuple[float, float, float], optional): Initial (x, y, z)
+            values. Defaults to (0.01, 0.0, 0.0).
+        num_steps (int, optional): Samples per trajectory. Defaults to 200.
+        num_samples (int, optional): Last samples kept per trajectory. Defaults to 100.
+        z_bins (int, optional): Histogram rows. Defaults to 1000.
+        z_limits (tuple[float, float], optional): Range of z. Defaults to (0, 400).
+
+    Returns:
+        np.ndarray: (len(rho_values), z_bins) histogram counts.
+    """
+    density = np.zeros(shape=(len(rho_values), z_bins), dtype=np.int64)
+    for idx, rho in enumerate(rho_values):
+        trajectory = lorenz_solver(initial_state=initial_state, rho=rho, num_steps=num_steps)
+        counts, _ = np.histogram(trajectory[2, -num_samples:], bins=z_bins, range=z_limits)
+        density[idx] += counts
+
+    return density
+
+
+def lorenz_tangent(
+        state: np.ndarray,
+        tangent: np.ndarray,
+        sigma: float = SIGMA,
+        rho: float = RHO,
+        beta: float = BETA,
+    ) -> np.ndarray:
+    """Variational equations of the Lorenz system, dv/dt = J(state) v.
+
+    Args:
+        state (np.ndarray): (3, ...) point on the trajectory.
+        tangent (np.ndarray): (3, ...) tangent vector v.
+        sigma (float, optional): Sigma parameter. Defaults to SIGMA.
+        rho (float, optional): Rho parameter. Defaults to RHO.
+        beta (float, optional): Beta parameter. Defaults to BETA.
+
+    Returns:
+        np.ndarray: (3, ...) time derivative of the tangent vector.
+    """
+    x, y, z = state
+    u, v, w = tangent
+    du_dt = sigma * (v - u)
+    dv_dt = (rho - z) * u - v - x * w
+    dw_dt = y * u + x * v - beta * w
+
+    return np.array([du_dt, dv_dt, dw_dt])
+
+
+def lorenz_lyapunov(
+        sigma: np.ndarray = SIGMA,
+        rho: np.ndarray = RHO,
+        beta: np.ndarray = BETA,
+        initial_state: tuple[float, float, float] = (0.01, 0.0, 0.0),
+        dt: float = TIME_STEP,
+        num_steps: int = NUM_STEPS,
+        transient_steps: int = 1000,
+        renorm_steps: int = RENORM_STEPS,
+    ) -> np.ndarray:
+    """Estimates the largest Lyapunov exponent for a batch of parameter sets.
+
+    The Lorenz system and its variational equations are integrated together
+    with a fixed step RK4 scheme over every parameter set at once. The tangent
+    vector is renormalized every `renorm_steps` steps and the exponent is the
+    average of the accumulated log growths.
+
+    Args:
+        sigma (np.ndarray, optional): Sigma values. Defaults to SIGMA.
+        rho (np.ndarray, optional): Rho values. Defaults to RHO.
+        beta (np.ndarray, optional): Beta values. Defaults to BETA.
+        initial_state (tuple[float, float, float], optional): Initial (x, y, z)
+            shared by every parameter set. Defaults to (0.01, 0.0, 0.0).
+        dt (float, optional): Integration time step. Defaults to TIME_STEP.
+        num_steps (int, optional): Steps used for the estimate. Defaults to NUM_STEPS.
+        transient_steps (int, optional): Steps discarded before the estimate.
+            Defaults to 1000.
+        renorm_steps (int, optional): Steps between renormalizations.
+            Defaults to RENORM_STEPS.
+
+    Returns:
+        np.ndarray: Largest Lyapunov exponent, broadcast shape of the parameters.
+    """
+    sigma, rho, beta = np.broadcast_arrays(
+        np.asarray(sigma, dtype=np.float64),
+        np.asarray(rho, dtype=np.float64),
+        np.asarray(beta, dtype=np.float64),
+    )
+    shape = sigma.shape
+    sigma, rho, beta = sigma.ravel(), rho.ravel(), beta.ravel()
+    params = (sigma, rho, beta)
+
+    state = np.repeat(np.asarray(initial_state, dtype=np.float64)[:, None], sigma.size, axis=1)
+    tangent = np.ones_like(state) / np.sqrt(3)
+    log_growth = np.zeros(sigma.size)
+
+    def rhs(state, tangent):
+        return np.array(lorenz_system(0, state, *params)), lorenz_tangent(state, tangent, *params)
+
+    for step in range(1, transient_steps + num_steps + 1):
+        # RK4 on the joint (state, tangent) system
+        k1_s, k1_t = rhs(state, tangent)
+        k2_s, k2_t = rhs(state + 0.5 * dt * k1_s, tangent + 0.5 * dt * k1_t)
+        k3_s, k3_t = rhs(state + 0.5 * dt * k2_s, tangent + 0.5 * dt * k2_t)
+        k4_s, k4_t = rhs(state + dt * k3_s, tangent + dt * k3_t)
+        state = state + dt / 6 * (k1_s + 2 * k2_s + 2 * k3_s + k4_s)
+        tangent = tangent + dt / 6 * (k1_t + 2 * k2_t + 2 * k3_t + k4_t)
+
+        if step % renorm_steps == 0 or step == transient_steps:
+            norm = np.linalg.norm(tangent, axis=0)
+            tangent = tangent / norm
+            # Growth during the transient only aligns the tangent vector
+            if step > transient_steps:
+                log_growth += np.log(norm)
+
+    # Renormalize once more to count the growth since the last renormalization
+    log_growth += np.log(np.linalg.norm(tangent, axis=0))
+
+    return (log_growth / (num_steps * dt)).reshape(shape)
+
+
+def plot_trajectory(ax, trajectory: np.ndarray, cmap=plt.cm.plasma, alpha: float = 0.4):
+    """Draws a trajectory coloured by time as a single line collection.
+
+    Args:
+        ax (Axes3D): 3D axes to draw on.
+        trajectory (np.ndarray): (3, n) trajectory.
+        cmap (Colormap, optional): Colormap along time. Defaults to plt.cm.plasma.
+        alpha (float, optional): Line transparency. Defaults to 0.4.
+
+    Returns:
+        Line3DCollection: The added collection.
+    """
+    points = np.asarray(trajectory).T
+    segments = np.stack((points[:-1], points[1:]), axis=1)
+    colors = cmap(np.linspace(0, 1, len(segments)))
+    lines = Line3DCollection(segments, colors=colors, alpha=alpha)
+    ax.add_collection3d(lines)
+    ax.auto_scale_xyz(points[:, 0], points[:, 1], points[:, 2])
+
+    return lines
+
 
 def main():
     # Initial state for x, y, z
@@ -96,17 +453,7 @@ def main():
 
     # The plot coloring idea is taken from:
     # https://scipython.com/blog/the-lorenz-attractor/
-    s = 10
-    cmap = plt.cm.plasma
-    for i in range(0, NUM_STEPS-s, s):
-
-        ax.plot(
-            trajectory[0,i:i+s+1],
-            trajectory[1,i:i+s+1],
-            trajectory[2,i:i+s+1],
-            color=cmap(i/NUM_STEPS),
-            alpha=0.4
-        )
+    plot_trajectory(ax, trajectory, cmap=plt.cm.plasma)
 
     ax.set_xlabel("x")
     ax.set_ylabel("y")
@@ -128,15 +475,16 @@ def main():
     num_rho_values = 500
     rho_values = np.linspace(start=0, stop=250, num=num_rho_values)
     num_steps = 200
-# 
-    plt.figure(figsize=(10, 10))
-    for rho in rho_values:
-        # Initial state for x, y, z
-        initial_state = (0.01, 0.0, 0.0)
+    z_limits = (0, 400)
+
+    # Last 100 z values for every rho, streamed into a histogram and drawn log-scaled
+    density = bifurcation_density(rho_values, num_steps=num_steps, num_samples=100, z_limits=z_limits)
 
-        trajectory = lorenz_solver(initial_state=initial_state, rho=rho, num_steps=num_steps)  # Saves the last coor
-        
-        plt.scatter([rho for _ in range(len(trajectory[2,-100:]))], trajectory[2,-100:], c="black", marker='.', s=1, linewidths=0)
+    plt.figure(figsize=(10, 10))
+    plt.imshow(
+        np.log1p(density.T), cmap="binary", origin="lower", aspect="auto",
+        extent=(rho_values[0], rho_values[-1], *z_limits)
+    )
 
     plt.title("Lorenz bifurcation plot")
     plt.xlabel("$r$")